@@ -1,91 +1,332 @@
 # agents.py
 # ----------
-# Value iteration agents (synchronous, asynchronous, prioritized sweeping) used to solve MDP
-
-from util import PriorityQueue
-import pickle
+# Value iteration agents (synchronous, sparse, afterstate, backward induction, asynchronous, prioritized sweeping) used to solve MDP
+# and expectimax search and n-tuple TD learning agents for boards too large to enumerate
+
+from abc import ABC, abstractmethod
+from util import PriorityQueue, LRUCache
+from bellman import TransitionModel, AfterstateModel, IndexedValues, ACTIONS, build_predecessors, pack_policy, get_policy_code
+from parallel import ParallelBackup
+from simulator import BatchSimulator
+from gameboard import GameBoard, PackedGameBoard
+import numpy as np
+import bitboard
+import metrics
+from multiprocessing import Pool
+import random
+import time
+import hashlib
+import json
+import glob
 import os
 from matrix import *
-from multiprocessing import Pool
 
+# number of games played from each derived random number stream during evaluation
+EVAL_CHUNK_SIZE = 10000
 
-class ValueIterationAgent:
-    def __init__(self, mdp, gamma=0.9, iterations=100, pref='', use_cache=True, processes=-1):
-        print('Constructing value iteration agent...')
+# agent shared with evaluation worker processes
+_eval_agent = None
+
+
+def set_eval_agent(agent):
+    global _eval_agent
+    _eval_agent = agent
+
+
+def play_eval_games(n, seed):
+    return _eval_agent.play_games(n, seed)
 
+
+class Agent(ABC):
+    # an agent choosing actions in the states of an mdp, evaluated by playing games
+    def __init__(self, mdp):
         self.mdp = mdp
+
+    @abstractmethod
+    def get_policy(self, state):
+        ...
+
+    def can_get_policies(self):
+        # whether get_policies is fast enough to play games in the batch simulator
+        return False
+
+    def get_policies(self, boards):
+        # get_policy over an array of packed non-terminal boards, returning indices into ACTIONS
+        return np.array([ACTIONS.index(self.get_policy(self.mdp.from_packed(int(b)))) for b in boards],
+                        dtype=np.int64)
+
+    def evaluate(self, n, seed=None, processes=1):
+        # perform the given number of evaluations, split into fixed-size chunks that each get an independent
+        # random number stream derived from the master seed, so results only depend on the seed
+        print(f'Performing {n} evaluation runs...')
+        if seed is None:
+            seed = random.getrandbits(64)
+        num_chunks = -(-n // EVAL_CHUNK_SIZE)
+        chunk_seeds = np.random.SeedSequence(seed).spawn(num_chunks)
+        chunks = [(min(EVAL_CHUNK_SIZE, n - k*EVAL_CHUNK_SIZE), chunk_seeds[k]) for k in range(num_chunks)]
+
+        with metrics.phase('evaluate', agent=type(self).__name__, processes=processes):
+            if processes > 1:
+                with Pool(processes, initializer=set_eval_agent, initargs=(self,)) as pool:
+                    results = pool.starmap(play_eval_games, chunks)
+            else:
+                results = [self.play_games(num_games, chunk_seed) for num_games, chunk_seed in chunks]
+            metrics.count('games', n)
+
+        # merge results across chunks
+        win_count = sum(wins for wins, _ in results)
+        self.eval_scores = np.concatenate([scores for _, scores in results])
+        return win_count/n
+
+    def play_games(self, n, seed):
+        # play n games from the given seed, returning the win count and the final score of every game
+        if self.can_get_policies():
+            # play all games at once in the batch simulator
+            simulator = BatchSimulator(self.mdp.board_size, self.mdp.win_score, np.random.default_rng(seed))
+            wins, scores = simulator.play(n, self.get_policies)
+            return int(wins.sum()), scores
+
+        rng = random.Random(int(seed.generate_state(1)[0]))
+        win_count = 0
+        scores = np.zeros(n, dtype=np.int64)
+        for k in range(n):
+            # generate a start state
+            state = self.mdp.generate_start_state(rng)
+
+            while not self.mdp.is_terminal(state):
+                a = self.get_policy(state)
+                state, score_increment = self.mdp.move(state, a)
+                scores[k] += score_increment
+                state = self.mdp.add_new_tile(state, rng)
+            if self.mdp.is_win_state(state):
+                win_count += 1
+        return win_count, scores
+
+
+class ValueIterationAgent(Agent):
+    def __init__(self, mdp, gamma=0.9, iterations=100, pref='', use_cache=True, processes=-1, epsilon=None,
+                 checkpoint_iterations=None, checkpoint_seconds=None, resume=False, warm_start=None):
+        print('Constructing value iteration agent...')
+
+        Agent.__init__(self, mdp)
         self.gamma = gamma
         self.iterations = iterations
         self.processes = processes
-
-        self.cache_filepath = f'./out/{pref}value_iteration_agent_{self.mdp.board_size}_{self.mdp.win_score}.pkl'
+        if processes != -1 and processes < 1:
+            raise ValueError(f'Invalid number of processes: {processes}')
+
+        # stop early once the greedy policy is guaranteed epsilon-optimal (iterations is then an upper bound)
+        self.epsilon = epsilon
+        self.residuals = []
+
+        # cached files are keyed by a hash of everything the values depend on
+        self.pref = pref
+        self.config = self.get_config()
+        config_hash = hashlib.sha1(json.dumps(self.config, sort_keys=True).encode()).hexdigest()[:12]
+        filepath = f'./out/{pref}value_iteration_agent_{self.mdp.cache_key}_{config_hash}'
+        self.cache_filepath = f'{filepath}.npy'
+        self.policy_filepath = f'{filepath}_policy.npy'
+        self.config_filepath = f'{filepath}_config.json'
+        self.policy = None
+
+        # checkpoint a run in progress every checkpoint_iterations iterations or checkpoint_seconds seconds
+        self.checkpoint_filepath = f'{filepath}_checkpoint.npz'
+        self.checkpoint_iterations = checkpoint_iterations
+        self.checkpoint_seconds = checkpoint_seconds
+        # iteration to start from and agent-specific state, restored when resuming from a checkpoint
+        self.start_iteration = 0
+        self.checkpoint_state = {}
 
         if use_cache and os.path.isfile(self.cache_filepath):
-            self.load_agent()
+            with metrics.phase('load_agent', agent=type(self).__name__):
+                self.load_agent()
         else:
-            # initialize values of terminal states
+            # seed values from a solved configuration, terminal values are then set for this one
             self.values = {}
+            if warm_start is not None:
+                self.load_warm_start(warm_start)
+
+            # initialize values of terminal states
             win_states = self.mdp.get_win_states()
             lose_states = self.mdp.get_lose_states()
             for s in win_states:
                 self.values[s] = 1
             for s in lose_states:
                 self.values[s] = -1
+            if resume:
+                self.load_checkpoint()
             print('Running value iteration...')
-            self.run_value_iteration()
-            self.save_agent()
+            self.last_checkpoint = (self.start_iteration, time.time())
+            with metrics.phase('value_iteration', agent=type(self).__name__, board=self.mdp.cache_key):
+                self.run_value_iteration()
+            self.report_convergence()
+            with metrics.phase('save_agent', agent=type(self).__name__):
+                self.save_agent()
+            # the finished run supersedes its checkpoint
+            if os.path.isfile(self.checkpoint_filepath):
+                os.remove(self.checkpoint_filepath)
+
+    def get_config(self):
+        # everything the values depend on
+        return {'agent': self.pref, 'board': self.mdp.get_config(), 'gamma': self.gamma, 'iterations': self.iterations,
+                'epsilon': self.epsilon}
 
     def save_agent(self):
-        with open(self.cache_filepath, 'wb') as f:
-            pickle.dump(self.values, f)
+        # store values as a float array aligned with the mdp's stored states, along with the greedy policy
+        np.save(self.cache_filepath, self.get_value_array())
+        self.policy = self.extract_policy()
+        np.save(self.policy_filepath, self.policy)
+        # the configuration is written last, it marks the values as solved for warm starts
+        with open(self.config_filepath, 'w') as f:
+            json.dump({'config': self.config, 'values': self.cache_filepath}, f, indent=2)
 
     def load_agent(self):
-        with open(self.cache_filepath, 'rb') as f:
-            self.values = pickle.load(f)
-
-    def evaluate(self, n):
-        # perform the given number of evaluations
-        print(f'Performing {n} evaluation runs...')
-        win_count = 0
-        for _ in range(n):
-            # generate a start state
-            state = generate_start_state(self.mdp.board_size)
-
-            while not self.mdp.is_terminal(state):
-                a = self.get_policy(state)
-                if a == 'left':
-                    state, _ = left(state)
-                elif a == 'right':
-                    state, _ = right(state)
-                elif a == 'up':
-                    state, _ = up(state)
-                elif a == 'down':
-                    state, _ = down(state)
-                else:
-                    raise ValueError(f'Invalid action: {a}')
-                state = add_new_tile(state)
-            if is_win_state(state, self.mdp.win_score):
-                win_count += 1
-        return win_count/n
+        # memory-map the stored values and policy, they are looked up through the mdp's state index
+        self.values = IndexedValues(self.mdp, np.load(self.cache_filepath, mmap_mode='r'))
+        if os.path.isfile(self.policy_filepath):
+            self.policy = np.load(self.policy_filepath, mmap_mode='r')
+        else:
+            self.policy = self.extract_policy()
+            np.save(self.policy_filepath, self.policy)
+
+    def extract_policy(self):
+        # greedy action of every state as an index into ACTIONS, packed 2 bits per state
+        codes = [ACTIONS.index(a) if a is not None else 0 for a in map(self.compute_policy, self.mdp.get_states())]
+        return pack_policy(codes)
+
+    def get_value_array(self):
+        if isinstance(self.values, IndexedValues):
+            return np.asarray(self.values.array)
+        return np.array([self.values.get(s, 0) for s in self.mdp.get_states()], dtype=float)
+
+    def checkpoint_due(self, iteration):
+        last_iteration, last_time = self.last_checkpoint
+        if self.checkpoint_iterations is not None and iteration - last_iteration >= self.checkpoint_iterations:
+            return True
+        return self.checkpoint_seconds is not None and time.time() - last_time >= self.checkpoint_seconds
+
+    def save_checkpoint(self, iteration, values=None, **state):
+        # write values aligned with the mdp's states, the iteration to resume from, the residual history and any
+        # agent-specific state to a temporary file first, so an interrupted write keeps the previous checkpoint
+        if values is None:
+            values = self.get_value_array()
+        os.makedirs(os.path.dirname(self.checkpoint_filepath), exist_ok=True)
+        tmp_filepath = f'{self.checkpoint_filepath}.tmp'
+        with open(tmp_filepath, 'wb') as f:
+            np.savez(f, values=values, iteration=iteration, residuals=np.array(self.residuals, dtype=float),
+                     gamma=self.gamma, **state)
+        os.replace(tmp_filepath, self.checkpoint_filepath)
+        self.last_checkpoint = (iteration, time.time())
+        metrics.record('checkpoint', agent=type(self).__name__, iteration=iteration)
+
+    def load_checkpoint(self):
+        # continue from the latest checkpoint of this agent and mdp, if there is one
+        if not os.path.isfile(self.checkpoint_filepath):
+            print(f'No checkpoint to resume from at {self.checkpoint_filepath}')
+            return
+        states = self.mdp.get_states()
+        with np.load(self.checkpoint_filepath) as checkpoint:
+            if len(checkpoint['values']) != len(states) or float(checkpoint['gamma']) != self.gamma:
+                print(f'Ignoring checkpoint of a different configuration at {self.checkpoint_filepath}')
+                return
+            self.values = dict(zip(states, checkpoint['values'].tolist()))
+            self.start_iteration = int(checkpoint['iteration'])
+            self.residuals = checkpoint['residuals'].tolist()
+            self.checkpoint_state = {k: checkpoint[k] for k in checkpoint.files
+                                     if k not in ['values', 'iteration', 'residuals', 'gamma']}
+        print(f'Resuming value iteration from iteration {self.start_iteration}')
+
+    def find_warm_start(self):
+        # solved configuration of the same board size closest to this one: the same win score with other
+        # parameters, then the largest lower win score, then the smallest higher one
+        candidates = []
+        for config_filepath in glob.glob('./out/*value_iteration_agent_*_config.json'):
+            if config_filepath == self.config_filepath:
+                continue
+            with open(config_filepath) as f:
+                board = json.load(f)['config']['board']
+            if board['board_size'] == self.mdp.board_size:
+                win_score = board['win_score']
+                candidates.append(((win_score == self.mdp.win_score, win_score < self.mdp.win_score,
+                                    win_score if win_score < self.mdp.win_score else -win_score), config_filepath))
+        return max(candidates)[1] if len(candidates) > 0 else None
+
+    def load_warm_start(self, config_filepath):
+        # seed values of the states shared with a solved configuration, given by its config file or 'auto'
+        if config_filepath == 'auto':
+            config_filepath = self.find_warm_start()
+            if config_filepath is None:
+                print('No solved configuration to warm start from')
+                return
+        with open(config_filepath) as f:
+            solved = json.load(f)
+        board = solved['config']['board']
+        board_class = {'GameBoard': GameBoard, 'PackedGameBoard': PackedGameBoard}[board['class']]
+        source = board_class(board['board_size'], board['win_score'], reachable=board['reachable'],
+                             symmetric=board['symmetric'])
+        if not source.store.exists():
+            print(f'States of {config_filepath} are not stored, not warm starting')
+            return
+        source_values = np.load(solved['values'], mmap_mode='r')
+
+        # look up every state in the solved store, mapped onto its representative when that board is symmetric
+        states = self.mdp.get_states()
+        packed_states, _ = source.canonicalize_packed([self.mdp.to_packed(s) for s in states])
+        indices = source.store.indices_of(packed_states)
+        for s, j in zip(states, indices.tolist()):
+            if j >= 0:
+                self.values[s] = float(source_values[j])
+        print(f'Warm started {int((indices >= 0).sum())}/{len(states)} states from {config_filepath}')
+
+    def has_converged(self, residual):
+        # record the max Bellman residual of a sweep, a residual below epsilon * (1 - gamma) / (2 * gamma)
+        # guarantees the greedy policy with respect to the current values is epsilon-optimal
+        self.residuals.append(residual)
+        metrics.record('residual', agent=type(self).__name__, sweep=len(self.residuals), residual=float(residual))
+        return self.is_converged(residual)
+
+    def get_threshold(self):
+        # residual below which the greedy policy is epsilon-optimal
+        return self.epsilon * (1 - self.gamma) / (2 * self.gamma)
+
+    def is_converged(self, residual):
+        return self.epsilon is not None and residual < self.get_threshold()
+
+    def report_convergence(self):
+        if len(self.residuals) == 0:
+            return
+        # the full history is recorded per sweep in the metrics
+        print(f'Bellman residual after {len(self.residuals)} sweeps: {self.residuals[-1]}')
+        if self.is_converged(self.residuals[-1]):
+            print(f'Converged to an {self.epsilon}-optimal policy (threshold {self.get_threshold()})')
+        elif self.epsilon is not None:
+            print(f'Did not converge to an {self.epsilon}-optimal policy (threshold {self.get_threshold()})')
 
     def run_value_iteration(self):
         # run given num of iterations
         iter_count = 0
         if self.processes != -1:
-            # run update calculations across multiple subprocesses
-            for i in range(self.iterations):
-                print(f'value iteration {i+1}/{self.iterations}')
-                pool = Pool(self.processes)
-                updated_state_vals = pool.map(self.get_updated_state_value, self.mdp.get_states())
-                pool.close()
-                pool.join()
-                for s, new_val, op_count in updated_state_vals:
-                    if s is not None:
-                        self.values[s] = new_val
-                        iter_count += op_count
+            # build the transition structure once, then share it with a persistent pool of workers
+            with metrics.phase('build_transition_model', board=self.mdp.cache_key):
+                model = TransitionModel(self.mdp)
+                metrics.count('transitions', model.num_transitions())
+            values = np.zeros(len(model.states))
+            for s, v in self.values.items():
+                values[model.index[s]] = v
+
+            with ParallelBackup(model, self.gamma, self.processes, values) as backup:
+                for i in range(self.start_iteration, self.iterations):
+                    print(f'value iteration {i+1}/{self.iterations}')
+                    values = backup.step()
+                    iter_count += model.num_transitions()
+                    if self.has_converged(float(np.abs(backup.values[0] - backup.values[1]).max())):
+                        break
+                    if self.checkpoint_due(i + 1):
+                        self.save_checkpoint(i + 1, values)
+                self.values = IndexedValues(self.mdp, values)
         else:
             # run update calculations iteratively
-            for i in range(self.iterations):
+            for i in range(self.start_iteration, self.iterations):
                 # compute new value for each state on every iteration
                 new_values = []
                 for s in self.mdp.get_states():
@@ -112,35 +353,20 @@ class ValueIterationAgent:
                     new_values.append((s, max(action_vals)))
 
                 # iteration complete, update all state values
+                residual = 0
                 for s, new_val in new_values:
+                    residual = max(residual, abs(new_val - (self.values[s] if s in self.values else 0)))
                     self.values[s] = new_val
+                if self.has_converged(residual):
+                    break
+                if self.checkpoint_due(i + 1):
+                    self.save_checkpoint(i + 1)
 
+        metrics.count('backups', iter_count)
         print(f'Performed iterations (value iteration agent): {iter_count}')
 
-    def get_updated_state_value(self, s):
-        # terminal values are known
-        if self.mdp.is_terminal(s):
-            return None, None, None
-
-        action_vals = []
-        op_count = 0
-        actions = self.mdp.get_legal_actions(s)
-
-        # check all possible actions, choose one with optimal value
-        for a in actions:
-            # calculate expected value (trans prob) * (reward + discount * val(succ))
-            succ_states_and_prob = self.mdp.get_succ_states_and_prob(s, a)
-            action_val = 0
-            for succ, succ_prob in succ_states_and_prob:
-                r = self.mdp.get_reward(s, a, succ)
-                succ_val = self.values[succ] if succ in self.values else 0
-                action_val += succ_prob * (r + self.gamma * succ_val)
-                op_count += 1
-            action_vals.append(action_val)
-
-        return s, max(action_vals), op_count
-
     def get_value(self, state):
+        state, _ = self.mdp.canonicalize(state)
         return self.values[state] if state in self.values else 0
 
     def get_q_value(self, state, action):
@@ -151,6 +377,39 @@ class ValueIterationAgent:
         return q_val
 
     def get_policy(self, state):
+        # look up the action of the canonical board in the policy table, then map it back onto the given board
+        state, transform = self.mdp.canonicalize(state)
+        i = self.mdp.index_of(state) if self.policy is not None else -1
+        if i < 0:
+            best_a = self.compute_policy(state)
+        elif self.mdp.is_terminal_index(i):
+            best_a = None
+        else:
+            best_a = ACTIONS[get_policy_code(self.policy, i)]
+        if best_a is None:
+            return None
+        return self.mdp.untransform_action(best_a, transform)
+
+    def can_get_policies(self):
+        # bulk policies need the policy table and boards that pack into 64 bits
+        return self.policy is not None and self.mdp.board_size * self.mdp.board_size * bitboard.CELL_BITS <= 64
+
+    def get_policies(self, boards):
+        # get_policy over an array of packed boards, returning indices into ACTIONS
+        boards, transforms = self.mdp.canonicalize_packed(boards)
+        indices = self.mdp.store.indices_of(boards)
+        codes = (np.asarray(self.policy)[indices >> 2] >> ((indices & 3) * 2)) & 3
+        for i in np.flatnonzero(indices < 0):
+            # boards outside the state set
+            codes[i] = ACTIONS.index(self.compute_policy(self.mdp.from_packed(int(boards[i]))))
+
+        # map actions back from the canonical boards
+        untransform = np.array([[ACTIONS.index(self.mdp.untransform_action(a, k)) for a in ACTIONS]
+                                for k in range(transforms.max(initial=0) + 1)])
+        return untransform[transforms, codes]
+
+    def compute_policy(self, state):
+        # choose the action with the largest q-value
         max_q = None
         best_a = None
         for a in self.mdp.get_legal_actions(state):
@@ -161,16 +420,145 @@ class ValueIterationAgent:
         return best_a
 
 
+class SparseValueIterationAgent(ValueIterationAgent):
+    def __init__(self, mdp, gamma=0.9, iterations=100, use_cache=True, epsilon=None, checkpoint_iterations=None,
+                 checkpoint_seconds=None, resume=False, warm_start=None):
+        self.model = None
+        ValueIterationAgent.__init__(self, mdp, gamma, iterations, pref='sparse_', use_cache=use_cache, epsilon=epsilon,
+                                     checkpoint_iterations=checkpoint_iterations,
+                                     checkpoint_seconds=checkpoint_seconds, resume=resume, warm_start=warm_start)
+
+    def extract_policy(self):
+        # after training, take the greedy policy straight from the transition model
+        if self.model is None:
+            return ValueIterationAgent.extract_policy(self)
+        q = self.model.q_values(np.asarray(self.values.array), self.gamma)
+        return pack_policy(np.where(self.model.terminal, 0, q.argmax(axis=0)))
+
+    def run_value_iteration(self):
+        # build the transition structure once, every iteration is then a few sparse mat-vec products
+        with metrics.phase('build_transition_model', board=self.mdp.cache_key):
+            self.model = TransitionModel(self.mdp)
+            metrics.count('transitions', self.model.num_transitions())
+        values = np.zeros(len(self.model.states))
+        for s, v in self.values.items():
+            values[self.model.index[s]] = v
+
+        iter_count = 0
+        for i in range(self.start_iteration, self.iterations):
+            new_values = self.model.backup(values, self.gamma)
+            iter_count += self.model.num_transitions()
+            residual = float(np.abs(new_values - values).max())
+            values = new_values
+            if self.has_converged(residual):
+                break
+            if self.checkpoint_due(i + 1):
+                self.save_checkpoint(i + 1, values)
+        self.values = IndexedValues(self.mdp, values)
+
+        metrics.count('backups', iter_count)
+        print(f'Performed iterations (sparse value iteration agent): {iter_count}')
+
+
+class AfterstateValueIterationAgent(SparseValueIterationAgent):
+    def __init__(self, mdp, gamma=0.9, iterations=100, use_cache=True, epsilon=None, checkpoint_iterations=None,
+                 checkpoint_seconds=None, resume=False, warm_start=None):
+        self.model = None
+        ValueIterationAgent.__init__(self, mdp, gamma, iterations, pref='afterstate_', use_cache=use_cache,
+                                     epsilon=epsilon, checkpoint_iterations=checkpoint_iterations,
+                                     checkpoint_seconds=checkpoint_seconds, resume=resume, warm_start=warm_start)
+
+    def run_value_iteration(self):
+        # each backup takes the expectation over tile spawns once per afterstate,
+        # then every state maxes over the (at most four) afterstates of its legal moves
+        with metrics.phase('build_afterstate_model', board=self.mdp.cache_key):
+            self.model = AfterstateModel(self.mdp)
+            metrics.count('transitions', self.model.num_transitions())
+        values = np.zeros(len(self.model.states))
+        for s, v in self.values.items():
+            values[self.model.index[s]] = v
+
+        iter_count = 0
+        for i in range(self.start_iteration, self.iterations):
+            new_values = self.model.backup(values, self.gamma)
+            iter_count += self.model.num_transitions()
+            residual = float(np.abs(new_values - values).max())
+            values = new_values
+            if self.has_converged(residual):
+                break
+            if self.checkpoint_due(i + 1):
+                self.save_checkpoint(i + 1, values)
+        self.values = IndexedValues(self.mdp, values)
+
+        metrics.count('backups', iter_count)
+        print(f'Performed iterations (afterstate value iteration agent): {iter_count}')
+
+
+class BackwardInductionAgent(ValueIterationAgent):
+    def __init__(self, mdp, gamma=0.9, use_cache=True, checkpoint_iterations=None, checkpoint_seconds=None,
+                 resume=False, warm_start=None):
+        # a single pass, checkpoints are taken between tile sum layers
+        ValueIterationAgent.__init__(self, mdp, gamma, iterations=1, pref='induction_', use_cache=use_cache,
+                                     checkpoint_iterations=checkpoint_iterations,
+                                     checkpoint_seconds=checkpoint_seconds, resume=resume, warm_start=warm_start)
+
+    def run_value_iteration(self):
+        # every move preserves the tile sum and every spawn adds 2 or 4, so successors always have a larger
+        # tile sum than their predecessor: the mdp is acyclic, and backing up states from the largest
+        # tile sum down computes exact values in a single pass
+        layers = {}
+        for s in self.mdp.get_states():
+            layers.setdefault(self.mdp.get_tile_sum(s), []).append(s)
+
+        iter_count = 0
+        tile_sums = sorted(layers, reverse=True)
+        for k in range(self.start_iteration, len(tile_sums)):
+            for s in layers[tile_sums[k]]:
+                # terminal values are known
+                if self.mdp.is_terminal(s):
+                    continue
+
+                # all successors are in later layers, so their values are already final
+                action_vals = []
+                for a in self.mdp.get_legal_actions(s):
+                    succ_states_and_prob = self.mdp.get_succ_states_and_prob(s, a)
+                    action_val = 0
+                    for succ, succ_prob in succ_states_and_prob:
+                        r = self.mdp.get_reward(s, a, succ)
+                        succ_val = self.values[succ] if succ in self.values else 0
+                        action_val += succ_prob * (r + self.gamma * succ_val)
+                        iter_count += 1
+                    action_vals.append(action_val)
+                self.values[s] = max(action_vals)
+            if self.checkpoint_due(k + 1):
+                self.save_checkpoint(k + 1)
+
+        metrics.count('backups', iter_count)
+        print(f'Performed iterations (backward induction agent): {iter_count}')
+
+
 class AsynchronousValueIterationAgent(ValueIterationAgent):
-    def __init__(self, mdp, gamma=0.9, iterations=1000000, use_cache=True):
-        ValueIterationAgent.__init__(self, mdp, gamma, iterations, pref='async_', use_cache=use_cache)
+    def __init__(self, mdp, gamma=0.9, iterations=1000000, use_cache=True, epsilon=None, checkpoint_iterations=None,
+                 checkpoint_seconds=None, resume=False, warm_start=None):
+        # iterations are single state updates, checkpoints are taken between sweeps
+        ValueIterationAgent.__init__(self, mdp, gamma, iterations, pref='async_', use_cache=use_cache, epsilon=epsilon,
+                                     checkpoint_iterations=checkpoint_iterations,
+                                     checkpoint_seconds=checkpoint_seconds, resume=resume, warm_start=warm_start)
 
     def run_value_iteration(self):
-        # run given num of iterations
-        states = self.mdp.get_states()
-        states.reverse()
+        # run given num of iterations (reversed copy, the mdp's state order is shared with the stored arrays)
+        states = self.mdp.get_states()[::-1]
         iter_count = 0
-        for i in range(self.iterations):
+        residual = 0
+        for i in range(self.start_iteration, self.iterations):
+            # a sweep ends after every state has been visited once (a resumed run starts right after one)
+            if i > self.start_iteration and i % len(states) == 0:
+                if self.has_converged(residual):
+                    break
+                residual = 0
+                if self.checkpoint_due(i):
+                    self.save_checkpoint(i)
+
             # get state for curr iteration
             s = states[i % len(states)]
             if self.mdp.is_terminal(s):
@@ -193,60 +581,79 @@ class AsynchronousValueIterationAgent(ValueIterationAgent):
                 action_vals.append(action_val)
 
             # update curr state value
+            residual = max(residual, abs(max(action_vals) - (self.values[s] if s in self.values else 0)))
             self.values[s] = max(action_vals)
+        metrics.count('backups', iter_count)
         print(f'Performed iterations (async value iteration agent): {iter_count}')
 
 
 class PrioritizedSweepingValueIterationAgent(AsynchronousValueIterationAgent):
-    def __init__(self, mdp, gamma=0.9, iterations=1000, theta=1e-5, use_cache=True):
+    def __init__(self, mdp, gamma=0.9, iterations=1000, theta=1e-5, use_cache=True, epsilon=None,
+                 checkpoint_iterations=None, checkpoint_seconds=None, resume=False, warm_start=None):
         self.theta = theta
-        ValueIterationAgent.__init__(self, mdp, gamma, iterations, pref='sweeping_', use_cache=use_cache)
+        ValueIterationAgent.__init__(self, mdp, gamma, iterations, pref='sweeping_', use_cache=use_cache,
+                                     epsilon=epsilon, checkpoint_iterations=checkpoint_iterations,
+                                     checkpoint_seconds=checkpoint_seconds, resume=resume, warm_start=warm_start)
+
+    def get_config(self):
+        return {**ValueIterationAgent.get_config(self), 'theta': self.theta}
 
     def run_value_iteration(self):
-        # 1. compute predecessors of all states
-        predecessors = {}
-        states = self.mdp.get_states()
-        states.reverse()
+        # 1. compute predecessors of all states (CSR arrays over state positions, cached with the states)
+        all_states = self.mdp.get_states()
+        state_index = self.mdp.get_state_index()
+        states = all_states[::-1]
         iter_count = 0
-        for s in states:
-            if self.mdp.is_terminal(s):
-                continue
-
-            for a in self.mdp.get_legal_actions(s):
-                succ_states_and_prob = self.mdp.get_succ_states_and_prob(s, a)
-                for succ, succ_prob in succ_states_and_prob:
-                    iter_count += 1
-                    if succ_prob > 0:
-                        if succ not in predecessors:
-                            predecessors[succ] = []
-                        predecessors[succ].append(s)
+        if not self.mdp.store.predecessors_exist():
+            with metrics.phase('build_predecessors', board=self.mdp.cache_key):
+                model = TransitionModel(self.mdp)
+                iter_count += model.num_transitions()
+                self.mdp.store.write_predecessors(*build_predecessors(model))
+                metrics.count('transitions', model.num_transitions())
+        pred_offsets, pred_indices = self.mdp.store.load_predecessors()
 
         # 2. init empty priority queue
         pq = PriorityQueue()
 
-        # 3. for each non-terminal state s...
-        for s in states:
-            if self.mdp.is_terminal(s):
-                continue
-
-            # 3a. diff = | V(s) - Q(s,a)_max |
-            q_max = None
-            for a in self.mdp.get_legal_actions(s):
-                iter_count += 1
-                q_a = self.get_q_value(s, a)
-                if q_max is None or q_a > q_max:
-                    q_max = q_a
-            diff = abs(self.values[s] if s in self.values else 0 - q_max)
+        # restore the queue of a checkpoint in insertion order, so ties pop in the same order
+        if 'queue_indices' in self.checkpoint_state:
+            for j, priority in zip(self.checkpoint_state['queue_indices'], self.checkpoint_state['queue_priorities']):
+                pq.push(all_states[j], float(priority))
+        else:
+            # 3. for each non-terminal state s...
+            for s in states:
+                if self.mdp.is_terminal(s):
+                    continue
+
+                # 3a. diff = | V(s) - Q(s,a)_max |
+                q_max = None
+                for a in self.mdp.get_legal_actions(s):
+                    iter_count += 1
+                    q_a = self.get_q_value(s, a)
+                    if q_max is None or q_a > q_max:
+                        q_max = q_a
+                diff = abs((self.values[s] if s in self.values else 0) - q_max)
 
-            # 3b. push s to priority queue w/ priority -diff
-            pq.push(s, -diff)
+                # 3b. push s to priority queue w/ priority -diff
+                pq.push(s, -diff)
 
         # 4. for iteration in 0->iterations-1...
-        for i in range(self.iterations):
-            # 4a. empty priority queue -> terminate
-            if pq.isEmpty():
-                print(f'Performed iterations (prioritized sweeping value iteration agent): {iter_count}')
-                return
+        for i in range(self.start_iteration, self.iterations):
+            if i > self.start_iteration and self.checkpoint_due(i):
+                entries = sorted((entry for entry in pq.heap if entry[3]), key=lambda entry: entry[1])
+                self.save_checkpoint(i, queue_indices=np.array([state_index[e[2]] for e in entries], dtype=np.int64),
+                                     queue_priorities=np.array([e[0] for e in entries], dtype=float))
+
+            # 4a. every queued priority bounds its state's residual (update only ever raises a priority) and every
+            # other residual is at most theta, so their max bounds the Bellman residual over all states
+            # empty priority queue or a bound below the epsilon-optimality threshold -> terminate
+            residual = self.theta if pq.isEmpty() else max(-pq.topPriority(), self.theta)
+            if pq.isEmpty() or self.is_converged(residual):
+                self.has_converged(residual)
+                break
+            # record the bound once per sweep's worth of pops
+            if i > self.start_iteration and i % len(states) == 0:
+                self.has_converged(residual)
 
             # 4b. pop s from priority queue
             s = pq.pop()
@@ -272,8 +679,9 @@ class PrioritizedSweepingValueIterationAgent(AsynchronousValueIterationAgent):
             self.values[s] = max(action_vals)
 
             # 4d. for each predecessor p of s...
-            if s in predecessors:
-                for p in predecessors[s]:
+            k = state_index[s]
+            if pred_offsets[k] < pred_offsets[k+1]:
+                for p in map(all_states.__getitem__, pred_indices[pred_offsets[k]:pred_offsets[k+1]]):
                     # 4di. diff = | V(p) - Q(p,a)_max |
                     q_max = None
                     for a in self.mdp.get_legal_actions(p):
@@ -281,8 +689,216 @@ class PrioritizedSweepingValueIterationAgent(AsynchronousValueIterationAgent):
                         q_a = self.get_q_value(p, a)
                         if q_max is None or q_a > q_max:
                             q_max = q_a
-                    diff = abs(self.values[p] if p in self.values else 0 - q_max)
+                    diff = abs((self.values[p] if p in self.values else 0) - q_max)
 
                     # 4dii. diff > theta -> push p to priority queue (if not already in pq with equal of lower priority)
                     if diff > self.theta:
                         pq.update(p, -diff)
+        metrics.count('backups', iter_count)
+        print(f'Performed iterations (prioritized sweeping value iteration agent): {iter_count}')
+
+
+class SearchTimeout(Exception):
+    # raised inside the search tree once the time budget of a move is spent
+    pass
+
+
+class ExpectimaxAgent(Agent):
+    def __init__(self, mdp, gamma=0.9, depth=3, min_prob=1e-3, time_limit=None, table_size=1000000):
+        print('Constructing expectimax agent...')
+
+        Agent.__init__(self, mdp)
+        self.gamma = gamma
+        # number of moves to look ahead
+        self.depth = depth
+        # chance outcomes reached with a lower probability are estimated instead of searched
+        self.min_prob = min_prob
+        # seconds per move, the deepest fully searched depth within the budget is used
+        self.time_limit = time_limit
+        # transposition table of state -> (searched depth, value), evicting the least recently used states
+        self.table = LRUCache(table_size)
+
+    def get_policy(self, state):
+        # search a single depth, or deepen iteratively until the time budget is spent
+        state = self.mdp.to_state(state)
+        if self.mdp.is_terminal(state):
+            return None
+        if self.time_limit is None:
+            return self.search(state, self.depth, None)
+        deadline = time.perf_counter() + self.time_limit
+        best_a = self.search(state, 1, None)
+        for depth in range(2, self.depth + 1):
+            try:
+                best_a = self.search(state, depth, deadline)
+            except SearchTimeout:
+                break
+        return best_a
+
+    def search(self, state, depth, deadline):
+        # choose the action with the largest expected value
+        max_q = None
+        best_a = None
+        for a in self.mdp.get_legal_actions(state):
+            q_a = self.get_chance_value(state, a, depth, 1, deadline)
+            if max_q is None or q_a > max_q:
+                max_q = q_a
+                best_a = a
+        return best_a
+
+    def get_chance_value(self, state, action, depth, prob, deadline):
+        # expectation over tile spawns after the move
+        q_val = 0
+        for succ, succ_prob in self.mdp.get_succ_states_and_prob(state, action):
+            succ_val = self.get_decision_value(succ, depth - 1, prob * succ_prob, deadline)
+            q_val += succ_prob * (self.mdp.get_reward(state, action, succ) + self.gamma * succ_val)
+        return q_val
+
+    def get_decision_value(self, state, depth, prob, deadline):
+        # terminal values match the value iteration agents
+        if self.mdp.is_terminal(state):
+            return 1 if self.mdp.is_win_state(state) else -1
+        if depth == 0 or prob < self.min_prob:
+            return self.get_heuristic_value(state)
+
+        # reuse values searched at least as deep
+        entry = self.table.get(state)
+        if entry is not None and entry[0] >= depth:
+            return entry[1]
+        if deadline is not None and time.perf_counter() > deadline:
+            raise SearchTimeout()
+
+        value = max(self.get_chance_value(state, a, depth, prob, deadline) for a in self.mdp.get_legal_actions(state))
+        self.table.put(state, (depth, value))
+        return value
+
+    def get_heuristic_value(self, state):
+        # estimate of a non-terminal leaf in [0, 1): progress of the largest tile towards the win tile,
+        # scaled down as the board fills up
+        tiles = [v for row in self.mdp.to_matrix(state) for v in row]
+        progress = (int(max(tiles)).bit_length() - 1) / (int(self.mdp.win_score).bit_length() - 1)
+        return progress * (1 + tiles.count(0) / len(tiles)) / 2
+
+
+class NTupleAgent(Agent):
+    def __init__(self, mdp, episodes=1000, learning_rate=0.1, tuple_length=4, checkpoint_interval=1000,
+                 use_cache=True, seed=None):
+        print('Constructing n-tuple agent...')
+
+        Agent.__init__(self, mdp)
+        self.episodes = episodes
+        self.checkpoint_interval = checkpoint_interval
+        self.rng = random.Random(seed)
+
+        # every tuple shape is looked up under all rotations/reflections of the board, sharing one weight table,
+        # so memory only depends on the tuple length: 16^tuple_length weights per shape
+        self.tuple_length = min(tuple_length, mdp.board_size)
+        self.table_size = 1 << (bitboard.CELL_BITS * self.tuple_length)
+        self.shapes = self.get_shapes()
+        self.feature_cells, self.feature_offsets = self.get_features()
+        self.cell_weights = 1 << (bitboard.CELL_BITS * np.arange(self.tuple_length, dtype=np.int64))
+        self.weights = np.zeros(len(self.shapes) * self.table_size, dtype=np.float32)
+        self.learning_rate = learning_rate / len(self.feature_cells)
+        self.trained_episodes = 0
+
+        self.checkpoint_filepath = f'./out/ntuple_agent_{self.mdp.cache_key}_{self.tuple_length}.npz'
+        if use_cache and os.path.isfile(self.checkpoint_filepath):
+            self.load_agent()
+        if self.trained_episodes < self.episodes:
+            print('Running TD learning...')
+            with metrics.phase('td_learning', agent=type(self).__name__, board=self.mdp.cache_key):
+                self.train(self.episodes - self.trained_episodes)
+
+    def get_shapes(self):
+        # (row, col) cells of each shape: the outer and inner lines and the corner and inner squares, where they fit
+        n = self.mdp.board_size
+        shapes = [[(0, j) for j in range(self.tuple_length)]]
+        if n > 2:
+            shapes.append([(1, j) for j in range(self.tuple_length)])
+        if self.tuple_length == 4:
+            shapes.append([(0, 0), (0, 1), (1, 0), (1, 1)])
+            if n > 3:
+                shapes.append([(1, 1), (1, 2), (2, 1), (2, 2)])
+        return shapes
+
+    def get_features(self):
+        # cells read by every distinct transformed lookup, and the offset of its shape's weight table
+        n = self.mdp.board_size
+        features = {}
+        for k, shape in enumerate(self.shapes):
+            for perm in self.mdp.symmetry_perms:
+                features.setdefault(tuple(perm[r*n + c] for r, c in shape), k * self.table_size)
+        return np.array(list(features.keys()), dtype=np.int64), np.array(list(features.values()), dtype=np.int64)
+
+    def get_weight_indices(self, state):
+        # index of every feature's weight, from the cell exponents of the board
+        cells = np.array(bitboard.get_cells(self.mdp.to_packed(self.mdp.to_state(state)), self.mdp.board_size))
+        return self.feature_offsets + cells[self.feature_cells] @ self.cell_weights
+
+    def get_value(self, afterstate):
+        # estimated game score still to come after reaching the afterstate
+        return float(self.weights[self.get_weight_indices(afterstate)].sum())
+
+    def get_afterstates(self, state):
+        # (action, afterstate, score increment) of every legal action
+        afterstates = []
+        for a in self.mdp.get_legal_actions(state):
+            afterstate, score_increment = self.mdp.move(state, a)
+            afterstates.append((a, afterstate, score_increment))
+        return afterstates
+
+    def get_policy(self, state):
+        # choose the action maximizing the score increment plus the value of its afterstate
+        if self.mdp.is_terminal(state):
+            return None
+        return self.choose_action(state)[0]
+
+    def choose_action(self, state):
+        max_q = None
+        best = None
+        for a, afterstate, score_increment in self.get_afterstates(state):
+            q_a = score_increment + self.get_value(afterstate)
+            if max_q is None or q_a > max_q:
+                max_q = q_a
+                best = (a, afterstate, score_increment)
+        return best
+
+    def train(self, episodes):
+        # afterstate TD(0) from self-play, values approximate the game score still to come
+        # (a game ends on the win tile, so a large score is only reached by winning or getting close)
+        for episode in range(episodes):
+            state = self.mdp.generate_start_state(self.rng)
+            prev_indices = None
+            while not self.mdp.is_terminal(state):
+                _, afterstate, score_increment = self.choose_action(state)
+                indices = self.get_weight_indices(afterstate)
+                if prev_indices is not None:
+                    self.update(prev_indices, score_increment + float(self.weights[indices].sum()))
+                prev_indices = indices
+                state = self.mdp.add_new_tile(afterstate, self.rng)
+            # nothing follows the last afterstate of a game
+            if prev_indices is not None:
+                self.update(prev_indices, 0)
+
+            self.trained_episodes += 1
+            metrics.count('games')
+            if self.trained_episodes % self.checkpoint_interval == 0:
+                print(f'TD learning episode {self.trained_episodes}/{self.episodes}')
+                self.save_agent()
+        self.save_agent()
+
+    def update(self, indices, target):
+        delta = target - float(self.weights[indices].sum())
+        np.add.at(self.weights, indices, self.learning_rate * delta)
+
+    def save_agent(self):
+        # write the checkpoint to a temporary file first, so an interrupted save keeps the previous checkpoint
+        os.makedirs(os.path.dirname(self.checkpoint_filepath), exist_ok=True)
+        tmp_filepath = f'{self.checkpoint_filepath}.tmp'
+        with open(tmp_filepath, 'wb') as f:
+            np.savez(f, weights=self.weights, trained_episodes=self.trained_episodes)
+        os.replace(tmp_filepath, self.checkpoint_filepath)
+
+    def load_agent(self):
+        with np.load(self.checkpoint_filepath) as checkpoint:
+            self.weights = checkpoint['weights'].copy()
+            self.trained_episodes = int(checkpoint['trained_episodes'])
@@ -0,0 +1,165 @@
+# bellman.py
+# ----------
+# Sparse transition model of an MDP for vectorized Bellman backups
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+ACTIONS = ['up', 'down', 'left', 'right']
+
+
+class TransitionModel:
+    def __init__(self, mdp):
+        # index all states of the mdp
+        self.states = mdp.get_states()
+        self.index = mdp.get_state_index()
+        num_states = len(self.states)
+
+        # per-action sparse transition matrices, expected rewards and legal action masks
+        self.terminal = np.zeros(num_states, dtype=bool)
+        self.legal = {a: np.zeros(num_states, dtype=bool) for a in ACTIONS}
+        self.rewards = {a: np.zeros(num_states) for a in ACTIONS}
+        rows = {a: [] for a in ACTIONS}
+        cols = {a: [] for a in ACTIONS}
+        probs = {a: [] for a in ACTIONS}
+        for i, s in enumerate(self.states):
+            if mdp.is_terminal(s):
+                self.terminal[i] = True
+                continue
+
+            for a in mdp.get_legal_actions(s):
+                self.legal[a][i] = True
+                for succ, succ_prob in mdp.get_succ_states_and_prob(s, a):
+                    self.rewards[a][i] += succ_prob * mdp.get_reward(s, a, succ)
+                    # successors outside the state space keep a value of 0
+                    j = self.index.get(succ)
+                    if j is not None:
+                        rows[a].append(i)
+                        cols[a].append(j)
+                        probs[a].append(succ_prob)
+
+        self.transitions = {
+            a: csr_matrix((probs[a], (rows[a], cols[a])), shape=(num_states, num_states)) for a in ACTIONS
+        }
+
+    def num_transitions(self):
+        return sum(p.nnz for p in self.transitions.values())
+
+    def q_values(self, values, gamma):
+        # Q(s,a) = R(s,a) + gamma * sum_s' P(s'|s,a) V(s'), -inf for illegal actions
+        q = np.full((len(ACTIONS), len(self.states)), -np.inf)
+        for k, a in enumerate(ACTIONS):
+            q_a = self.rewards[a] + gamma * (self.transitions[a] @ values)
+            q[k, self.legal[a]] = q_a[self.legal[a]]
+        return q
+
+    def backup(self, values, gamma):
+        # one synchronous Bellman backup, terminal values are kept fixed
+        return np.where(self.terminal, values, self.q_values(values, gamma).max(axis=0))
+
+
+class AfterstateModel:
+    # transition model factored through afterstates (boards after a move, before the tile spawn):
+    # the spawn distribution of each afterstate is expanded once and shared by every state and action moving to it
+    def __init__(self, mdp):
+        self.states = mdp.get_states()
+        self.index = mdp.get_state_index()
+        num_states = len(self.states)
+
+        # afterstate of every legal (action, state) pair as an index into the spawn matrix, -1 if illegal
+        self.terminal = np.zeros(num_states, dtype=bool)
+        self.afterstates = np.full((len(ACTIONS), num_states), -1, dtype=np.int64)
+        self.rewards = np.zeros((len(ACTIONS), num_states))
+        afterstate_index = {}
+        rows, cols, probs = [], [], []
+        for i, s in enumerate(self.states):
+            if mdp.is_terminal(s):
+                self.terminal[i] = True
+                continue
+
+            for a in mdp.get_legal_actions(s):
+                k = ACTIONS.index(a)
+                afterstate = mdp.get_afterstate(s, a)
+                # rewards of the game only depend on the state moved from
+                self.rewards[k, i] = mdp.get_reward(s, a, afterstate)
+                j = afterstate_index.get(afterstate)
+                if j is None:
+                    j = afterstate_index[afterstate] = len(afterstate_index)
+                    for succ, succ_prob in mdp.get_spawn_states_and_prob(afterstate):
+                        # successors outside the state space keep a value of 0
+                        m = self.index.get(succ)
+                        if m is not None:
+                            rows.append(j)
+                            cols.append(m)
+                            probs.append(succ_prob)
+                self.afterstates[k, i] = j
+
+        self.spawns = csr_matrix((probs, (rows, cols)), shape=(len(afterstate_index), num_states))
+
+    def num_transitions(self):
+        return self.spawns.nnz + int((self.afterstates >= 0).sum())
+
+    def q_values(self, values, gamma):
+        # Q(s,a) = R(s,a) + gamma * W(afterstate(s,a)), W(b) = sum_s' P(s'|b) V(s'), -inf for illegal actions
+        after_values = self.spawns @ values
+        legal = self.afterstates >= 0
+        q = np.full(self.afterstates.shape, -np.inf)
+        q[legal] = self.rewards[legal] + gamma * after_values[self.afterstates[legal]]
+        return q
+
+    def backup(self, values, gamma):
+        # one synchronous Bellman backup, terminal values are kept fixed
+        return np.where(self.terminal, values, self.q_values(values, gamma).max(axis=0))
+
+
+# deduplicated predecessors of every state as CSR arrays (offsets, indices):
+# the predecessors of state j are indices[offsets[j]:offsets[j+1]]
+def build_predecessors(model):
+    successors = sum(model.transitions[a] for a in ACTIONS)
+    predecessors = successors.T.tocsr()
+    predecessors.sum_duplicates()
+    return predecessors.indptr.astype(np.int64), predecessors.indices.astype(np.int32)
+
+
+# pack action indices (into ACTIONS) 2 bits per state, 4 states per byte
+def pack_policy(codes):
+    codes = np.asarray(codes, dtype=np.uint8)
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    padded = padded.reshape(-1, 4)
+    return padded[:, 0] | (padded[:, 1] << 2) | (padded[:, 2] << 4) | (padded[:, 3] << 6)
+
+
+# read the action index of the i-th state from a packed policy
+def get_policy_code(policy, i):
+    return (int(policy[i >> 2]) >> ((i & 3) * 2)) & 3
+
+
+class IndexedValues:
+    # dict-like view of a dense value array aligned with the states of an mdp
+
+    def __init__(self, mdp, array):
+        self.mdp = mdp
+        self.array = array
+
+    def __contains__(self, state):
+        return self.mdp.index_of(state) >= 0
+
+    def __getitem__(self, state):
+        i = self.mdp.index_of(state)
+        if i < 0:
+            raise KeyError(state)
+        return float(self.array[i])
+
+    def __setitem__(self, state, value):
+        i = self.mdp.index_of(state)
+        if i < 0:
+            raise KeyError(state)
+        self.array[i] = value
+
+    def __len__(self):
+        return len(self.array)
+
+    def get(self, state, default=None):
+        i = self.mdp.index_of(state)
+        return float(self.array[i]) if i >= 0 else default
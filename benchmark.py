@@ -0,0 +1,166 @@
+# benchmark.py
+# ----------
+# Micro (move engine, MDP primitives) and macro (training runs, evaluation throughput) benchmarks
+# Results are written as JSON, and compared against a baseline file to flag regressions
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import matrix
+from gameboard import GameBoard, PackedGameBoard
+from agents import ValueIterationAgent, AsynchronousValueIterationAgent, PrioritizedSweepingValueIterationAgent, \
+    AfterstateValueIterationAgent
+
+
+# run fn the given number of times per repeat, returning the best time of a single call in seconds
+def time_calls(fn, number, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = (time.perf_counter() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+# time fn once per repeat, keeping the agents' progress output out of the report
+def time_run(fn, repeat):
+    def quiet():
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+    return time_calls(quiet, 1, repeat)
+
+
+# random boards reached by playing random moves from a start state
+def random_boards(board_size, count, seed=0):
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        mat = matrix.generate_start_state(board_size, rng)
+        while not matrix.is_lose_state(mat) and len(boards) < count:
+            boards.append([row[:] for row in mat])
+            mat, _ = rng.choice([matrix.left, matrix.right, matrix.up, matrix.down])(mat)
+            mat = matrix.add_new_tile(mat, rng)
+    return boards
+
+
+def micro_benchmarks(repeat):
+    results = {}
+    boards = random_boards(4, 1000)
+
+    # move engine, per call over a fixed set of 4x4 boards
+    for name, fn in [('left', matrix.left), ('right', matrix.right), ('up', matrix.up), ('down', matrix.down),
+                     ('horizontal_move_exists', matrix.horizontal_move_exists), ('is_lose_state', matrix.is_lose_state)]:
+        seconds = time_calls(lambda: [fn(b) for b in boards], 1, repeat) / len(boards)
+        results[f'micro/matrix.{name}'] = {'seconds': seconds}
+
+    # successor generation over states of a 3x3 board
+    for board_class in [GameBoard, PackedGameBoard]:
+        mdp = board_class(3, 16)
+        states = [mdp.to_state(b) for b in random_boards(3, 1000) if not mdp.is_terminal(mdp.to_state(b))]
+        seconds = time_calls(lambda: [mdp.get_succ_states_and_prob(s, a) for s in states for a in ['up', 'left']],
+                             1, repeat) / (2 * len(states))
+        results[f'micro/{board_class.__name__}.get_succ_states_and_prob'] = {'seconds': seconds}
+
+    # state enumeration, bypassing the state store
+    for board_class, board_size, win_score, reachable in [(GameBoard, 2, 32, False), (PackedGameBoard, 2, 32, False),
+                                                          (PackedGameBoard, 3, 16, True)]:
+        mdp = board_class(board_size, win_score, reachable=reachable)
+        enumerate_states = mdp.get_reachable_states if reachable else mdp.get_all_states
+        seconds = time_run(enumerate_states, repeat)
+        name = f'micro/{board_class.__name__}.get_states_{board_size}_{win_score}{"_reachable" if reachable else ""}'
+        results[name] = {'seconds': seconds, 'states': len(enumerate_states())}
+    return results
+
+
+def macro_benchmarks(repeat, n_eval):
+    results = {}
+
+    # one training run of each tabular agent on a fixed amount of work
+    mdp = GameBoard(2, 32)
+    num_states = len(mdp.get_states())
+    for name, make_agent in [
+        ('sync', lambda: ValueIterationAgent(mdp, iterations=20, use_cache=False)),
+        ('async', lambda: AsynchronousValueIterationAgent(mdp, iterations=20 * num_states, use_cache=False)),
+        ('sweeping', lambda: PrioritizedSweepingValueIterationAgent(mdp, iterations=2000, use_cache=False))
+    ]:
+        results[f'macro/train_{name}_2_32'] = {'seconds': time_run(make_agent, repeat)}
+
+    # evaluation throughput of a trained agent
+    for board_size, win_score in [(2, 32), (2, 64), (3, 16)]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            agent = AfterstateValueIterationAgent(PackedGameBoard(board_size, win_score, reachable=True))
+        seconds = time_run(lambda: agent.evaluate(n_eval, seed=0), repeat)
+        results[f'macro/evaluate_{board_size}_{win_score}'] = {'seconds': seconds, 'games_per_second': n_eval / seconds}
+    return results
+
+
+# benchmarks slower than the baseline by more than the threshold (a fraction of the baseline time)
+def find_regressions(results, baseline, threshold):
+    regressions = {}
+    for name, result in results.items():
+        if name in baseline and result['seconds'] > baseline[name]['seconds'] * (1 + threshold):
+            regressions[name] = result['seconds'] / baseline[name]['seconds']
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-g', dest='group', help='Benchmark group to run (micro, macro, all).', default='all')
+    parser.add_argument('-r', dest='repeat', help='Number of repeats, the best time is kept (default 3).', default=3)
+    parser.add_argument('-n', dest='neval', help='Number of games per evaluation benchmark (default 10000).', default=10000)
+    parser.add_argument('-o', dest='output', help='JSON file to write results to.', default='./out/benchmark.json')
+    parser.add_argument('-c', dest='baseline', help='JSON baseline file to compare results against.', default=None)
+    parser.add_argument('-t', dest='threshold', help='Allowed slowdown against the baseline (default 0.1).', default=0.1)
+    args = parser.parse_args()
+
+    group = args.group
+    repeat = int(args.repeat)
+    n_eval = int(args.neval)
+    threshold = float(args.threshold)
+    if group not in ['micro', 'macro', 'all']:
+        raise ValueError(f'Invalid benchmark group: {group}')
+
+    # agents and boards cache under ./out, run in a scratch directory so the user's caches are left alone
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline is not None else None
+    cwd = os.getcwd()
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            if group in ['micro', 'all']:
+                results.update(micro_benchmarks(repeat))
+            if group in ['macro', 'all']:
+                results.update(macro_benchmarks(repeat, n_eval))
+        finally:
+            os.chdir(cwd)
+    for name, result in results.items():
+        print(f'{name}: {result["seconds"]:.3e} s')
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'python': platform.python_version(), 'timestamp': time.time(), 'benchmarks': results}, f, indent=2)
+
+    # compare against the baseline, failing on regressions
+    if baseline_path is not None:
+        with open(baseline_path) as f:
+            baseline = json.load(f)['benchmarks']
+        regressions = find_regressions(results, baseline, threshold)
+        for name, ratio in regressions.items():
+            print(f'Regression: {name} is {ratio:.2f}x the baseline time')
+        if regressions:
+            raise SystemExit(1)
+        print(f'No regressions against {args.baseline} (threshold {threshold})')
+
+
+if __name__ == '__main__':
+    main()
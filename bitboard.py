@@ -0,0 +1,161 @@
+# bitboard.py
+# ----------
+# Specifies packed board (game state) operations
+# A board is a single int holding 4 bits per cell: the log2 of the tile, or 0 for an empty cell.
+# Cells are stored row-major, with the top-left cell in the lowest 4 bits.
+
+import random
+import matrix
+
+CELL_BITS = 4
+CELL_MASK = (1 << CELL_BITS) - 1
+MAX_EXPONENT = CELL_MASK
+
+
+# convert a tile value to the exponent stored in a cell
+def tile_exponent(v):
+    if v == 0:
+        return 0
+    e = int(v).bit_length() - 1
+    if e > MAX_EXPONENT:
+        raise ValueError(f'Tile too large for packed board: {v}')
+    return e
+
+
+# pack a matrix of tile values into a board
+def pack(mat):
+    board = 0
+    shift = 0
+    for row in mat:
+        for v in row:
+            board |= tile_exponent(v) << shift
+            shift += CELL_BITS
+    return board
+
+
+# unpack a board into a matrix of tile values
+def unpack(board, board_size):
+    return [[1 << e if e else 0 for e in row] for row in get_rows(board, board_size)]
+
+
+# list the exponents of all cells in row-major order
+def get_cells(board, board_size):
+    return [(board >> (CELL_BITS * i)) & CELL_MASK for i in range(board_size * board_size)]
+
+
+# build a board from a row-major list of exponents
+def from_cells(cells):
+    board = 0
+    for i, e in enumerate(cells):
+        board |= e << (CELL_BITS * i)
+    return board
+
+
+# split a board into rows of exponents
+def get_rows(board, board_size):
+    cells = get_cells(board, board_size)
+    return [cells[i*board_size:(i+1)*board_size] for i in range(board_size)]
+
+
+# build a board from rows of exponents
+def from_rows(rows):
+    return from_cells([e for row in rows for e in row])
+
+
+# transpose board over its diagonal
+def transpose(board, board_size):
+    rows = get_rows(board, board_size)
+    return from_rows([[rows[j][i] for j in range(board_size)] for i in range(board_size)])
+
+
+# slide and combine a single row of exponents to the left
+def move_row_left(row):
+    tiles = [e for e in row if e != 0]
+    moved_row = []
+    score_increment = 0
+    k = 0
+    while k < len(tiles):
+        if k + 1 < len(tiles) and tiles[k] == tiles[k+1]:
+            moved_row.append(tiles[k] + 1)
+            score_increment += 1 << (tiles[k] + 1)
+            k += 2
+        else:
+            moved_row.append(tiles[k])
+            k += 1
+    moved_row.extend([0] * (len(row) - len(moved_row)))
+    return moved_row, score_increment
+
+
+# determine whether a move exists along the rows of the board
+def horizontal_move_exists(board, board_size):
+    for row in get_rows(board, board_size):
+        for j in range(board_size):
+            if row[j] == 0:
+                return True
+            if j < board_size - 1 and row[j] == row[j+1]:
+                return True
+    return False
+
+
+# determine whether a move exists along the columns of the board
+def vertical_move_exists(board, board_size):
+    return horizontal_move_exists(transpose(board, board_size), board_size)
+
+
+# indicate whether given board is a win state
+def is_win_state(board, board_size, win_score):
+    return tile_exponent(win_score) in get_cells(board, board_size)
+
+
+# indicate whether given board is a lose state
+def is_lose_state(board, board_size):
+    return not horizontal_move_exists(board, board_size) and not vertical_move_exists(board, board_size)
+
+
+# generate a legal start board given board size, drawing from the given random number generator
+def generate_start_state(board_size, rng=random):
+    return pack(matrix.generate_start_state(board_size, rng))
+
+
+# add tile (2 or 4) to empty cell in given board, drawing from the given random number generator
+def add_new_tile(board, board_size, rng=random):
+    empty_cells = [i for i, e in enumerate(get_cells(board, board_size)) if e == 0]
+    if len(empty_cells) == 0:
+        return board
+    i = rng.choice(empty_cells)
+    e = 1 if rng.random() < 0.9 else 2
+    return board | (e << (CELL_BITS * i))
+
+
+# move left, returning the new board and the score increment
+def left(board, board_size):
+    score_increment = 0
+    moved_rows = []
+    for row in get_rows(board, board_size):
+        moved_row, row_score = move_row_left(row)
+        moved_rows.append(moved_row)
+        score_increment += row_score
+    return from_rows(moved_rows), score_increment
+
+
+# move right (reverse rows, move left, reverse rows)
+def right(board, board_size):
+    score_increment = 0
+    moved_rows = []
+    for row in get_rows(board, board_size):
+        moved_row, row_score = move_row_left(row[::-1])
+        moved_rows.append(moved_row[::-1])
+        score_increment += row_score
+    return from_rows(moved_rows), score_increment
+
+
+# move up (transpose, move left, transpose)
+def up(board, board_size):
+    board, score_increment = left(transpose(board, board_size), board_size)
+    return transpose(board, board_size), score_increment
+
+
+# move down (transpose, move right, transpose)
+def down(board, board_size):
+    board, score_increment = right(transpose(board, board_size), board_size)
+    return transpose(board, board_size), score_increment
@@ -0,0 +1,63 @@
+# cli.py
+# ----------
+# Command line arguments and board/agent construction shared by the game, test, train and server scripts
+
+import metrics
+from agents import ValueIterationAgent, SparseValueIterationAgent, AfterstateValueIterationAgent, \
+    BackwardInductionAgent, AsynchronousValueIterationAgent, PrioritizedSweepingValueIterationAgent, ExpectimaxAgent, \
+    NTupleAgent
+from gameboard import GameBoard, PackedGameBoard
+
+CACHED_EPSILON_HELP = 'Epsilon the value iteration agent was trained with, to find its cache.'
+
+
+def add_common_arguments(parser, epsilon_help=CACHED_EPSILON_HELP):
+    # board, agent and instrumentation arguments every script accepts
+    parser.add_argument('-a', dest='agent', help='Agent to use for action selection (sync, sparse, afterstate, induction, async, sweeping, expectimax, ntuple).', default='sync')
+    parser.add_argument('-s', dest='board_size', help='Board dimension (default 2).', default=2)
+    parser.add_argument('-w', dest='win_score', help='Winning score (default 32).', default=32)
+    parser.add_argument('-b', dest='packed', help='Boolean flag to use packed bitboard states.', action='store_true')
+    parser.add_argument('-r', dest='reachable', help='Boolean flag to only use states reachable from a start state.', action='store_true')
+    parser.add_argument('-y', dest='symmetric', help='Boolean flag to reduce states by board rotations/reflections.', action='store_true')
+    parser.add_argument('-e', dest='epsilon', help=epsilon_help, default=None)
+    parser.add_argument('-t', dest='time_limit', help='Seconds per move for the expectimax agent (default: search full depth).', default=None)
+    parser.add_argument('--metrics', dest='metrics', help='File to append JSON lines of run metrics to (- for stderr).', default=None)
+    parser.add_argument('--profile', dest='profile', help='Run under cProfile, dumping the stats to the given file.', default=None)
+
+
+def run_with_metrics(run, args):
+    # run the script with its metrics and profile enabled as requested
+    if args.metrics is not None:
+        metrics.enable(args.metrics)
+    with metrics.profile(args.profile):
+        run(args)
+
+
+def make_board(args):
+    board_class = PackedGameBoard if args.packed else GameBoard
+    return board_class(int(args.board_size), int(args.win_score), reachable=args.reachable, symmetric=args.symmetric)
+
+
+def make_agent(args, mdp, use_cache=True, processes=-1, episodes=1000, **checkpoint):
+    # construct the selected agent, checkpoint holds the value iteration checkpoint and warm start arguments
+    agent_type = args.agent
+    epsilon = float(args.epsilon) if args.epsilon is not None else None
+    time_limit = float(args.time_limit) if args.time_limit is not None else None
+    if agent_type == 'sync':
+        return ValueIterationAgent(mdp, use_cache=use_cache, processes=processes, epsilon=epsilon, **checkpoint)
+    elif agent_type == 'sparse':
+        return SparseValueIterationAgent(mdp, use_cache=use_cache, epsilon=epsilon, **checkpoint)
+    elif agent_type == 'afterstate':
+        return AfterstateValueIterationAgent(mdp, use_cache=use_cache, epsilon=epsilon, **checkpoint)
+    elif agent_type == 'induction':
+        return BackwardInductionAgent(mdp, use_cache=use_cache, **checkpoint)
+    elif agent_type == 'async':
+        return AsynchronousValueIterationAgent(mdp, use_cache=use_cache, epsilon=epsilon, **checkpoint)
+    elif agent_type == 'sweeping':
+        return PrioritizedSweepingValueIterationAgent(mdp, use_cache=use_cache, epsilon=epsilon, **checkpoint)
+    elif agent_type == 'expectimax':
+        return ExpectimaxAgent(mdp, time_limit=time_limit)
+    elif agent_type == 'ntuple':
+        # the n-tuple agent checkpoints its weights on its own, resuming continues from them
+        return NTupleAgent(mdp, episodes=episodes, use_cache=use_cache or checkpoint.get('resume', False))
+    raise ValueError(f'Invalid agent type: {agent_type}')
@@ -1,9 +1,11 @@
 # colors.py
 # ----------
-# GUI color hex codes, fonts
+# GUI color hex codes, fonts, and their procedural extension to any tile value and cell size
 # Derived from Kite 2048 project
 # Source: https://www.youtube.com/watch?v=b4XP2IcI-Bg
 
+import colorsys
+
 GRID_COLOR = "#a39489"
 EMPTY_CELL_COLOR = "#c2b3a9"
 SCORE_LABEL_FONT = ("Verdana", 18)
@@ -54,3 +56,25 @@ CELL_NUMBER_FONTS = {
     1024: ("Helvetica", 40, "bold"),
     2048: ("Helvetica", 40, "bold")
 }
+
+
+# background color of a tile, tiles past 2048 cycle through darker hues
+def cell_color(value):
+    if value == 0:
+        return EMPTY_CELL_COLOR
+    if value in CELL_COLORS:
+        return CELL_COLORS[value]
+    exponent = value.bit_length() - 1
+    r, g, b = colorsys.hls_to_rgb((0.61 * exponent) % 1, 0.35, 0.6)
+    return f'#{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}'
+
+
+def cell_number_color(value):
+    return CELL_NUMBER_COLORS.get(value, "#ffffff")
+
+
+# font of a tile's number, shrinking with the number of digits and fitting cells of the given size in pixels
+def cell_number_font(value, cell_dim):
+    digits = len(str(value))
+    size = min(60 - 5 * min(digits, 4), 0.5 * cell_dim, 1.4 * cell_dim / digits)
+    return ("Helvetica", max(6, int(size)), "bold")
@@ -3,35 +3,82 @@
 # MDP representation of 2048 game
 
 from mdp import MarkovDecisionProcess
-from itertools import product, chain
+from itertools import product
 from matrix import *
-from copy import deepcopy
-import pickle
-import os
+from movetable import get_move_table
+from store import StateStore
+import numpy as np
+import bitboard
+import metrics
+import random
+
+# the 8 rotations/reflections of a square board, as matrices acting on (row, col) offsets from the board centre
+SYMMETRIES = [
+    ((1, 0), (0, 1)),
+    ((0, 1), (-1, 0)),
+    ((-1, 0), (0, -1)),
+    ((0, -1), (1, 0)),
+    ((1, 0), (0, -1)),
+    ((-1, 0), (0, 1)),
+    ((0, 1), (1, 0)),
+    ((0, -1), (-1, 0))
+]
+
+# (row, col) direction of each action
+ACTION_DIRECTIONS = {
+    'up': (-1, 0),
+    'down': (1, 0),
+    'left': (0, -1),
+    'right': (0, 1)
+}
+
+# flags of a state in the precomputed tables: one bit per legal action (in ACTION_DIRECTIONS order), win and lose
+ACTION_FLAGS = {a: 1 << k for k, a in enumerate(ACTION_DIRECTIONS)}
+ACTION_MASK = (1 << len(ACTION_FLAGS)) - 1
+WIN_FLAG = 1 << len(ACTION_FLAGS)
+LOSE_FLAG = WIN_FLAG << 1
+TERMINAL_FLAGS = WIN_FLAG | LOSE_FLAG
+
+# legal actions of every combination of action bits
+LEGAL_ACTIONS = [[a for a in ACTION_DIRECTIONS if flags & ACTION_FLAGS[a]] for flags in range(ACTION_MASK + 1)]
+
+# boards canonicalized per vectorized call when enumerating, bounding the memory of their transformed copies
+CANONICALIZE_CHUNK_SIZE = 1 << 16
 
 
 class GameBoard(MarkovDecisionProcess):
-    def __init__(self, board_size, win_score):
+    # prefix distinguishing cached files of different state representations
+    state_prefix = ''
+
+    def __init__(self, board_size, win_score, reachable=False, symmetric=False):
         # game parameters
         self.board_size = board_size
         self.win_score = win_score
 
-        # load states if available
-        self.states_path = f'./out/states_{self.board_size}_{self.win_score}.pkl'
-        self.win_states_path = f'./out/win_states_{self.board_size}_{self.win_score}.pkl'
-        self.lose_states_path = f'./out/lose_states_{self.board_size}_{self.win_score}.pkl'
-        if os.path.isfile(self.states_path):
-            self.load_states()
-        else:
-            self.states = []
-        if os.path.isfile(self.win_states_path):
-            self.load_win_states()
-        else:
-            self.win_states = []
-        if os.path.isfile(self.lose_states_path):
-            self.load_lose_states()
-        else:
-            self.lose_states = []
+        # restrict the state space to states reachable from a start state
+        self.reachable = reachable
+        # reduce the state space to one canonical representative per set of rotated/reflected boards
+        self.symmetric = symmetric
+        self.symmetry_perms = [self.get_symmetry_perm(m) for m in SYMMETRIES]
+        self.symmetry_perm_array = np.array(self.symmetry_perms)
+        # cell shifts of packed boards, and the same in the order canonicalize compares states
+        self.cell_shifts = np.uint64(bitboard.CELL_BITS) * np.arange(board_size * board_size, dtype=np.uint64)
+        self.order_shifts = self.get_symmetry_order_shifts(self.cell_shifts)
+        self.cache_key = f'{self.state_prefix}{self.board_size}_{self.win_score}'
+        if self.reachable:
+            self.cache_key += '_reachable'
+        if self.symmetric:
+            self.cache_key += '_symmetric'
+
+        # memory-map stored states if available
+        self.store = StateStore(f'./out/states_{self.cache_key}')
+        if self.store.exists():
+            self.store.load()
+        self.states = []
+        self.win_states = []
+        self.lose_states = []
+        self.state_index = None
+        self.state_flags = None
 
         # determine all possible values a square can hold
         self.possible_values = []
@@ -41,54 +88,149 @@ class GameBoard(MarkovDecisionProcess):
             possible_value /= 2
         self.possible_values.append(0)
 
+    def get_config(self):
+        # parameters the state space depends on, enough to rebuild the board
+        return {'class': type(self).__name__, 'board_size': self.board_size, 'win_score': self.win_score,
+                'reachable': self.reachable, 'symmetric': self.symmetric}
+
     def save_states(self):
-        with open(self.states_path, 'wb') as f:
-            pickle.dump(self.states, f)
+        # write packed states, their terminal masks and legal actions to the binary store
+        flags = [self.compute_state_flags(s) for s in self.states]
+        self.store.write([self.to_packed(s) for s in self.states],
+                         [bool(f & WIN_FLAG) for f in flags],
+                         [bool(f & LOSE_FLAG) for f in flags],
+                         [f & ACTION_MASK for f in flags])
+        self.state_flags = None
 
     def load_states(self):
-        with open(self.states_path, 'rb') as f:
-            self.states = pickle.load(f)
+        self.states = [self.from_packed(p) for p in self.store.states.tolist()]
+
+    def get_states(self):
+        if len(self.states) == 0:
+            if self.store.states is not None:
+                with metrics.phase('load_states', board=self.cache_key):
+                    self.load_states()
+                    metrics.count('states', len(self.states))
+            else:
+                with metrics.phase('enumerate_states', board=self.cache_key):
+                    if self.reachable:
+                        self.states = self.get_reachable_states()
+                    else:
+                        self.states = self.get_all_states()
+                    metrics.count('states', len(self.states))
+                # classifying states into terminal masks and legal actions happens on save
+                with metrics.phase('save_states', board=self.cache_key):
+                    self.save_states()
+                    metrics.count('states', len(self.states))
+        return self.states
 
-    def save_win_states(self):
-        with open(self.win_states_path, 'wb') as f:
-            pickle.dump(self.win_states, f)
+    def is_terminal_index(self, i):
+        # terminal check of the i-th state, read from the stored masks
+        return bool(self.store.win[i] or self.store.lose[i])
 
-    def load_win_states(self):
-        with open(self.win_states_path, 'rb') as f:
-            self.win_states = pickle.load(f)
+    def get_state_flags(self, state):
+        # flags of the state, read from the stored tables when it is a stored state
+        if self.store.actions is None:
+            return self.compute_state_flags(state)
+        if self.state_flags is None:
+            flags = np.asarray(self.store.actions) | (self.store.win * WIN_FLAG) | (self.store.lose * LOSE_FLAG)
+            self.state_flags = flags.astype(np.uint8).tobytes()
+        # use the dict index once all states are in memory, the store's binary search otherwise
+        state = self.to_state(state)
+        i = self.get_state_index().get(state, -1) if len(self.states) > 0 else self.index_of(state)
+        if i < 0:
+            return self.compute_state_flags(state)
+        return self.state_flags[i]
 
-    def save_lose_states(self):
-        with open(self.lose_states_path, 'wb') as f:
-            pickle.dump(self.lose_states, f)
+    def compute_state_flags(self, state):
+        flags = 0
+        if self.is_win_state(state):
+            flags |= WIN_FLAG
+        if self.is_lose_state(state):
+            flags |= LOSE_FLAG
+        # terminal states have no legal actions
+        if flags == 0:
+            for a in self.compute_legal_actions(state):
+                flags |= ACTION_FLAGS[a]
+        return flags
 
-    def load_lose_states(self):
-        with open(self.lose_states_path, 'rb') as f:
-            self.lose_states = pickle.load(f)
+    def get_state_index(self):
+        # map each state to its position in get_states()
+        if self.state_index is None:
+            self.state_index = {s: i for i, s in enumerate(self.get_states())}
+        return self.state_index
 
-    def get_states(self):
-        if len(self.states) == 0:
-            self.states = [tuple(map(tuple, [list(i[x:x+self.board_size]) for x in range(0, len(i), self.board_size)]))
-                           for i in product(self.possible_values, repeat=pow(self.board_size, 2))
-                           if not all([v == 0 for v in i]) and not list(i).count(self.win_score) > pow(self.board_size, 2)/2]
-            self.save_states()
-        return self.states
+    def index_of(self, state):
+        # position of the state in get_states(), or -1 if it is not a state of the mdp
+        state = self.to_state(state)
+        if self.state_index is None and self.store.states is not None:
+            return self.store.index_of(self.to_packed(state))
+        return self.get_state_index().get(state, -1)
+
+    def get_all_states(self):
+        if not self.symmetric:
+            return self.get_all_boards()
+        # keep the boards that are their own canonical representative, canonicalizing chunks of packed boards at once
+        boards = self.get_all_boards()
+        states = []
+        for k in range(0, len(boards), CANONICALIZE_CHUNK_SIZE):
+            chunk = boards[k:k + CANONICALIZE_CHUNK_SIZE]
+            packed = np.array([self.to_packed(s) for s in chunk], dtype=np.uint64)
+            is_canonical = self.canonicalize_packed(packed)[0] == packed
+            states.extend(s for s, c in zip(chunk, is_canonical.tolist()) if c)
+        return states
+
+    def get_all_boards(self):
+        return [tuple(map(tuple, [list(i[x:x+self.board_size]) for x in range(0, len(i), self.board_size)]))
+                for i in product(self.possible_values, repeat=pow(self.board_size, 2))
+                if not all([v == 0 for v in i]) and not list(i).count(self.win_score) > pow(self.board_size, 2)/2]
+
+    def get_start_states(self):
+        # every board a game can start from: two 2 tiles in distinct cells
+        start_states = []
+        cells = [(i, j) for i in range(self.board_size) for j in range(self.board_size)]
+        for k, (i1, j1) in enumerate(cells):
+            for i2, j2 in cells[k+1:]:
+                mat = [[0] * self.board_size for _ in range(self.board_size)]
+                mat[i1][j1] = 2
+                mat[i2][j2] = 2
+                start_states.append(self.to_state(mat))
+        return start_states
+
+    def get_reachable_states(self):
+        # breadth-first search over legal moves and tile spawns from every start state
+        states = list(dict.fromkeys(self.canonicalize(s)[0] for s in self.get_start_states()))
+        seen = set(states)
+        frontier = states
+        while len(frontier) > 0:
+            next_frontier = []
+            for s in frontier:
+                for a in self.get_legal_actions(s):
+                    for succ, succ_prob in self.get_succ_states_and_prob(s, a):
+                        if succ not in seen:
+                            seen.add(succ)
+                            next_frontier.append(succ)
+            states.extend(next_frontier)
+            frontier = next_frontier
+        return states
 
     def get_win_states(self):
         if len(self.win_states) == 0:
-            self.win_states = [state for state in self.get_states() if is_win_state(state, self.win_score)]
-            self.save_win_states()
+            states = self.get_states()
+            self.win_states = [states[i] for i in np.flatnonzero(self.store.win)]
         return self.win_states
 
     def get_lose_states(self):
         if len(self.lose_states) == 0:
-            self.lose_states = [state for state in self.get_states() if is_lose_state(state)]
-            self.save_lose_states()
+            states = self.get_states()
+            self.lose_states = [states[i] for i in np.flatnonzero(self.store.lose)]
         return self.lose_states
 
     def get_legal_actions(self, state):
-        if self.is_terminal(state):
-            return []
+        return list(LEGAL_ACTIONS[self.get_state_flags(state) & ACTION_MASK])
 
+    def compute_legal_actions(self, state):
+        # actions that change the board, ignoring whether the state is terminal
         legal_actions = []
         if vertical_move_exists(state):
             legal_actions.extend(['up', 'down'])
@@ -100,43 +242,267 @@ class GameBoard(MarkovDecisionProcess):
         if self.is_terminal(state):
             return []
 
-        # calculate new state after move
-        if action == 'left':
-            state, _ = left(state)
-        elif action == 'right':
-            state, _ = right(state)
-        elif action == 'up':
-            state, _ = up(state)
-        elif action == 'down':
-            state, _ = down(state)
-        else:
-            raise ValueError(f'Invalid action: {action}')
+        # calculate new state after move, then spawn a tile on it
+        state, _ = self.move(state, action)
+        return self.get_spawn_states_and_prob(self.to_state(state))
 
-        # create separate successor state for each empty space being filled by either 2 or 4
+    def get_afterstate(self, state, action):
+        # board after the move but before the tile spawn (canonical when symmetric), shared by every
+        # state and action that moves to it
+        afterstate, _ = self.move(state, action)
+        return self.canonicalize(self.to_state(afterstate))[0]
+
+    def get_spawn_states_and_prob(self, afterstate):
+        # create separate successor state for each empty cell being filled by either 2 or 4
+        cells = self.get_cells(afterstate)
+        empty_cells = [i for i, v in enumerate(cells) if v == 0]
         succ_states_and_prob = []
-        num_zero_squares = list(chain.from_iterable(state)).count(0)
-        for i, row in enumerate(state):
-            for j, v in enumerate(row):
-                if v == 0:
-                    succ_state_2 = deepcopy(state)
-                    succ_state_2[i][j] = 2
-                    succ_state_2_tup = tuple(map(tuple, succ_state_2))
-                    succ_states_and_prob.append((succ_state_2_tup, 0.9/num_zero_squares))
-
-                    succ_state_4 = deepcopy(state)
-                    succ_state_4[i][j] = 4
-                    succ_state_4_tup = tuple(map(tuple, succ_state_4))
-                    succ_states_and_prob.append((succ_state_4_tup, 0.1/num_zero_squares))
-        return succ_states_and_prob
+        for i in empty_cells:
+            for v, prob in [(2, 0.9), (4, 0.1)]:
+                succ_cells = list(cells)
+                succ_cells[i] = v
+                succ_states_and_prob.append((self.from_cells(succ_cells), prob/len(empty_cells)))
+        return self.merge_symmetric_states(succ_states_and_prob)
+
+    def merge_symmetric_states(self, succ_states_and_prob):
+        # map successors to their canonical representatives, summing the probabilities of symmetric boards
+        if not self.symmetric or len(succ_states_and_prob) == 0:
+            return succ_states_and_prob
+        # canonicalize the whole batch of successors at once
+        canonical_succs, _ = self.canonicalize_packed([self.to_packed(succ) for succ, _ in succ_states_and_prob])
+        merged = {}
+        for canonical_succ, (_, succ_prob) in zip(canonical_succs.tolist(), succ_states_and_prob):
+            canonical_succ = self.from_packed(canonical_succ)
+            merged[canonical_succ] = merged.get(canonical_succ, 0) + succ_prob
+        return list(merged.items())
+
+    def get_symmetry_perm(self, m):
+        # perm[t] is the cell moved onto cell t by the transform, using doubled offsets from the board centre
+        perm = []
+        for r in range(self.board_size):
+            for c in range(self.board_size):
+                y, x = 2*r - (self.board_size-1), 2*c - (self.board_size-1)
+                src_y, src_x = m[0][0]*y + m[1][0]*x, m[0][1]*y + m[1][1]*x
+                perm.append((src_y + self.board_size-1) // 2 * self.board_size + (src_x + self.board_size-1) // 2)
+        return perm
+
+    def transform_state(self, state, transform):
+        cells = self.get_cells(state)
+        return self.from_cells([cells[i] for i in self.symmetry_perms[transform]])
+
+    def canonicalize(self, state):
+        # get the canonical representative of the state and the index of the transform that produces it
+        if not self.symmetric:
+            return state, 0
+        canonical_state, canonical_transform = None, 0
+        for transform in range(len(SYMMETRIES)):
+            transformed_state = self.transform_state(state, transform)
+            if canonical_state is None or transformed_state < canonical_state:
+                canonical_state, canonical_transform = transformed_state, transform
+        return canonical_state, canonical_transform
+
+    def canonicalize_packed(self, boards):
+        # vectorized canonicalize over an array of packed boards, returning packed canonical boards
+        boards = np.asarray(boards, dtype=np.uint64)
+        if not self.symmetric:
+            return boards, np.zeros(len(boards), dtype=np.int64)
+        cells = (boards[:, None] >> self.cell_shifts) & np.uint64(bitboard.CELL_MASK)
+        # cells of every board under every transform, shaped (boards, transforms, cells)
+        transformed = cells[:, self.symmetry_perm_array]
+        candidates = np.bitwise_or.reduce(transformed << self.cell_shifts, axis=2)
+        # order candidates the same way canonicalize compares states
+        keys = candidates
+        if self.order_shifts is not self.cell_shifts:
+            keys = np.bitwise_or.reduce(transformed << self.order_shifts, axis=2)
+        transforms = keys.argmin(axis=1)
+        return candidates[np.arange(len(boards)), transforms], transforms
+
+    def get_symmetry_order_shifts(self, shifts):
+        # tuple states compare row-major, so the first cell is the most significant
+        return shifts[::-1]
+
+    @staticmethod
+    def transform_action(action, transform):
+        # the action on the transformed board that corresponds to the given action on the original board
+        m = SYMMETRIES[transform]
+        dy, dx = ACTION_DIRECTIONS[action]
+        direction = (m[0][0]*dy + m[0][1]*dx, m[1][0]*dy + m[1][1]*dx)
+        return next(a for a, d in ACTION_DIRECTIONS.items() if d == direction)
+
+    @staticmethod
+    def untransform_action(action, transform):
+        # the action on the original board that corresponds to the given action on the transformed board
+        m = SYMMETRIES[transform]
+        dy, dx = ACTION_DIRECTIONS[action]
+        direction = (m[0][0]*dy + m[1][0]*dx, m[0][1]*dy + m[1][1]*dx)
+        return next(a for a, d in ACTION_DIRECTIONS.items() if d == direction)
 
     def get_reward(self, state, action, succ):
-        if is_lose_state(state):
+        flags = self.get_state_flags(state)
+        if flags & LOSE_FLAG:
             return -1
-        elif is_win_state(state, self.win_score):
+        elif flags & WIN_FLAG:
             return 1
         else:
             return 0
 
     def is_terminal(self, state):
         # a state is terminal if there are no legal moves or the target score has been reached
-        return is_win_state(state, self.win_score) or is_lose_state(state)
+        return bool(self.get_state_flags(state) & TERMINAL_FLAGS)
+
+    def is_win_state(self, state):
+        return is_win_state(state, self.win_score)
+
+    def is_lose_state(self, state):
+        return is_lose_state(state)
+
+    def to_state(self, mat):
+        # convert a matrix of tile values into this board's state representation
+        return tuple(map(tuple, mat))
+
+    def to_matrix(self, state):
+        # convert a state into a matrix of tile values
+        return [list(row) for row in state]
+
+    def get_tile_sum(self, state):
+        # sum of all tiles, preserved by every move and increased by every spawn
+        return sum(v for row in state for v in row)
+
+    def to_packed(self, state):
+        # convert a state into a packed board (see bitboard.py) for the binary store
+        return bitboard.pack(state)
+
+    def from_packed(self, board):
+        return self.to_state(bitboard.unpack(board, self.board_size))
+
+    def get_cells(self, state):
+        # list the cells of a state in row-major order
+        return [v for row in state for v in row]
+
+    def from_cells(self, cells):
+        return tuple(tuple(cells[i*self.board_size:(i+1)*self.board_size]) for i in range(self.board_size))
+
+    def generate_start_state(self, rng=random):
+        return generate_start_state(self.board_size, rng)
+
+    def add_new_tile(self, state, rng=random):
+        return add_new_tile(state, rng)
+
+    def move(self, state, action):
+        # calculate new state after move, along with the score increment
+        if action == 'left':
+            return left(state)
+        elif action == 'right':
+            return right(state)
+        elif action == 'up':
+            return up(state)
+        elif action == 'down':
+            return down(state)
+        else:
+            raise ValueError(f'Invalid action: {action}')
+
+
+class PackedGameBoard(GameBoard):
+    # 2048 MDP over packed bitboard states (see bitboard.py), each state a single int
+    state_prefix = 'packed_'
+
+    def __init__(self, board_size, win_score, reachable=False, symmetric=False):
+        GameBoard.__init__(self, board_size, win_score, reachable, symmetric)
+        self.move_table = get_move_table(board_size, win_score)
+
+    def get_all_boards(self):
+        # enumerate cell exponents in the same order as the tile values of GameBoard
+        exponents = [bitboard.tile_exponent(v) for v in self.possible_values]
+        win_exponent = bitboard.tile_exponent(self.win_score)
+        return [bitboard.from_cells(cells)
+                for cells in product(exponents, repeat=pow(self.board_size, 2))
+                if any(cells) and not cells.count(win_exponent) > pow(self.board_size, 2)/2]
+
+    def compute_state_flags(self, state):
+        # checks each move direction once, the lose flag is the absence of legal moves
+        moves = 0
+        if self.move_table.vertical_move_exists(state):
+            moves |= ACTION_FLAGS['up'] | ACTION_FLAGS['down']
+        if self.move_table.horizontal_move_exists(state):
+            moves |= ACTION_FLAGS['left'] | ACTION_FLAGS['right']
+        flags = 0 if moves else LOSE_FLAG
+        if self.is_win_state(state):
+            flags |= WIN_FLAG
+        # terminal states have no legal actions
+        return flags or moves
+
+    def compute_legal_actions(self, state):
+        legal_actions = []
+        if self.move_table.vertical_move_exists(state):
+            legal_actions.extend(['up', 'down'])
+        if self.move_table.horizontal_move_exists(state):
+            legal_actions.extend(['left', 'right'])
+        return legal_actions
+
+    def get_succ_states_and_prob(self, state, action):
+        if self.is_terminal(state):
+            return []
+
+        # calculate new state after move, then spawn a tile on it
+        state, _ = self.move(state, action)
+        return self.get_spawn_states_and_prob(state)
+
+    def get_spawn_states_and_prob(self, state):
+        # create separate successor state for each empty cell being filled by either 2 or 4
+        empty_cells = [i for i, e in enumerate(bitboard.get_cells(state, self.board_size)) if e == 0]
+        succ_states_and_prob = []
+        for i in empty_cells:
+            shift = bitboard.CELL_BITS * i
+            succ_states_and_prob.append((state | (1 << shift), 0.9/len(empty_cells)))
+            succ_states_and_prob.append((state | (2 << shift), 0.1/len(empty_cells)))
+        return self.merge_symmetric_states(succ_states_and_prob)
+
+    def is_win_state(self, state):
+        return self.move_table.is_win_state(state)
+
+    def is_lose_state(self, state):
+        return self.move_table.is_lose_state(state)
+
+    def to_state(self, mat):
+        if isinstance(mat, int):
+            return mat
+        return bitboard.pack(mat)
+
+    def to_matrix(self, state):
+        return bitboard.unpack(state, self.board_size)
+
+    def get_symmetry_order_shifts(self, shifts):
+        return shifts
+
+    def get_tile_sum(self, state):
+        return sum(1 << e for e in self.get_cells(state) if e != 0)
+
+    def to_packed(self, state):
+        return state
+
+    def from_packed(self, board):
+        return board
+
+    def get_cells(self, state):
+        return bitboard.get_cells(state, self.board_size)
+
+    def from_cells(self, cells):
+        return bitboard.from_cells(cells)
+
+    def generate_start_state(self, rng=random):
+        return bitboard.generate_start_state(self.board_size, rng)
+
+    def add_new_tile(self, state, rng=random):
+        return bitboard.add_new_tile(state, self.board_size, rng)
+
+    def move(self, state, action):
+        if action == 'left':
+            return self.move_table.left(state)
+        elif action == 'right':
+            return self.move_table.right(state)
+        elif action == 'up':
+            return self.move_table.up(state)
+        elif action == 'down':
+            return self.move_table.down(state)
+        else:
+            raise ValueError(f'Invalid action: {action}')
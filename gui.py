@@ -0,0 +1,131 @@
+# gui.py
+# ----------
+# Tk GUI of the modified 2048 game, drawing the board of a game runner and stepping it one move per event
+# Derived from Kite 2048 project
+# Source: https://www.youtube.com/watch?v=b4XP2IcI-Bg
+
+import tkinter as tk
+import colors as c
+from matrix import is_lose_state
+
+
+class Game(tk.Frame):
+    def __init__(self, runner, delay=300):
+        # board params, moves are scheduled on the Tk event loop every delay milliseconds (0 for unthrottled play)
+        self.runner = runner
+        self.board_size = runner.board_size
+        self.board_dim = 600
+        self.cell_dim = self.board_dim / self.board_size
+        self.delay = delay
+
+        tk.Frame.__init__(self)
+        self.grid()
+        self.master.title("2048")
+        self.main_grid = tk.Canvas(
+            self, bg=c.GRID_COLOR, width=self.board_dim, height=self.board_dim, highlightthickness=0
+        )
+        self.main_grid.grid(pady=(100, 0))
+        self.make_gui()
+        self.update_gui()
+
+        if not self.check_game_over():
+            self.after(self.delay, self.make_move)
+
+        self.mainloop()
+
+    @staticmethod
+    def delete_label(label):
+        label.pack_forget()
+
+    def make_gui(self):
+        # one rectangle and one text item per cell on a single canvas
+        self.cells = []
+        pad = 5
+        for i in range(self.board_size):
+            row = []
+            for j in range(self.board_size):
+                x, y = j * self.cell_dim, i * self.cell_dim
+                cell_data = {
+                    'rect': self.main_grid.create_rectangle(
+                        x + pad, y + pad, x + self.cell_dim - pad, y + self.cell_dim - pad,
+                        fill=c.EMPTY_CELL_COLOR, width=0
+                    ),
+                    'number': self.main_grid.create_text(x + self.cell_dim / 2, y + self.cell_dim / 2, text='')
+                }
+                row.append(cell_data)
+            self.cells.append(row)
+        # values currently drawn, None until a cell is first drawn
+        self.drawn = [[None] * self.board_size for _ in range(self.board_size)]
+
+        score_frame = tk.Frame(self)
+        score_frame.place(relx=0.5, y=45, anchor='center')
+        tk.Label(
+            score_frame,
+            text='Score',
+            font=c.SCORE_LABEL_FONT
+        ).grid(row=0)
+        self.score_label = tk.Label(score_frame, text='0', font=c.SCORE_FONT)
+        self.score_label.grid(row=1)
+
+    def make_move(self):
+        # apply the next action directly, then schedule the following move instead of recursing
+        policy = self.runner.step()
+        print(f'Policy: {policy}')
+
+        self.update_gui()
+        if not self.check_game_over():
+            self.after(self.delay, self.make_move)
+        else:
+            print(f'Agent policy: {self.runner.actions}')
+
+    def update_gui(self):
+        # redraw only the cells whose value changed since the last update
+        for i in range(self.board_size):
+            for j in range(self.board_size):
+                cell_val = self.runner.matrix[i][j]
+                if cell_val == self.drawn[i][j]:
+                    continue
+                self.drawn[i][j] = cell_val
+                self.main_grid.itemconfigure(self.cells[i][j]['rect'], fill=c.cell_color(cell_val))
+                if cell_val == 0:
+                    self.main_grid.itemconfigure(self.cells[i][j]['number'], text='')
+                else:
+                    self.main_grid.itemconfigure(
+                        self.cells[i][j]['number'],
+                        fill=c.cell_number_color(cell_val),
+                        font=c.cell_number_font(cell_val, self.cell_dim),
+                        text=str(cell_val)
+                    )
+        self.score_label.configure(text=self.runner.score)
+        self.update_idletasks()
+
+    def check_game_over(self):
+        if self.runner.is_win():
+            self.update_gui_win()
+            return True
+        elif is_lose_state(self.runner.matrix):
+            self.update_gui_lose()
+            return True
+        return False
+
+    def update_gui_lose(self):
+        game_over_frame = tk.Frame(self.main_grid, borderwidth=2)
+        game_over_frame.place(relx=0.5, rely=0.5, anchor='center')
+        tk.Label(
+            game_over_frame,
+            text='Game over!',
+            bg=c.LOSER_BG,
+            fg=c.GAME_OVER_FONT_COLOR,
+            font=c.GAME_OVER_FONT
+        ).pack()
+
+    def update_gui_win(self):
+        game_over_frame = tk.Frame(self.main_grid, borderwidth=2)
+        game_over_frame.place(relx=0.5, rely=0.5, anchor='center')
+        tk.Label(
+            game_over_frame,
+            text='You win!',
+            bg=c.WINNER_BG,
+            fg=c.GAME_OVER_FONT_COLOR,
+            font=c.GAME_OVER_FONT
+        ).pack()
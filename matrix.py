@@ -82,36 +82,24 @@ def is_lose_state(mat):
     return not horizontal_move_exists(mat) and not vertical_move_exists(mat)
 
 
-# generate a legal start state given board size
-def generate_start_state(board_size):
+# generate a legal start state given board size, drawing from the given random number generator
+def generate_start_state(board_size, rng=random):
     mat = [[0] * board_size for _ in range(board_size)]
 
-    # select two random cells to initialize as 2
-    row = random.randint(0, board_size-1)
-    col = random.randint(0, board_size-1)
-    mat[row][col] = 2
-    while mat[row][col] != 0:
-        row = random.randint(0, board_size-1)
-        col = random.randint(0, board_size-1)
-    mat[row][col] = 2
+    # select two distinct random cells to initialize as 2
+    for i in rng.sample(range(board_size * board_size), 2):
+        mat[i // board_size][i % board_size] = 2
     return mat
 
 
-# add tile (2 or 4) to empty space in given state
-def add_new_tile(mat):
-    if all([t != 0 for r in mat for t in r]):
+# add tile (2 or 4) to empty space in given state, drawing from the given random number generator
+def add_new_tile(mat, rng=random):
+    empty_cells = [(i, j) for i, row in enumerate(mat) for j, v in enumerate(row) if v == 0]
+    if len(empty_cells) == 0:
         return mat
 
-    board_size = len(mat)
-    row = random.randint(0, board_size-1)
-    col = random.randint(0, board_size-1)
-    while mat[row][col] != 0:
-        row = random.randint(0, board_size-1)
-        col = random.randint(0, board_size-1)
-    mat[row][col] = random.choices(
-        population=[2, 4],
-        weights=[0.9, 0.1]
-    )[0]
+    row, col = rng.choice(empty_cells)
+    mat[row][col] = 2 if rng.random() < 0.9 else 4
     return mat
 
 
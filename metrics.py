@@ -0,0 +1,86 @@
+# metrics.py
+# ----------
+# Instrumentation shared by the boards, agents and CLIs: per-phase wall time, counters and their rates,
+# residuals and peak memory, emitted as JSON lines once enabled, and an opt-in cProfile wrapper
+
+from contextlib import contextmanager
+import cProfile
+import json
+import pstats
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak memory is then not reported
+    resource = None
+
+# file metrics are written to, None while metrics are disabled
+_sink = None
+
+# counters of the currently open phases, innermost last
+_phases = []
+
+
+def enable(path):
+    # write metrics to the given file, '-' for stderr
+    global _sink
+    _sink = sys.stderr if path == '-' else open(path, 'a')
+
+
+def enabled():
+    return _sink is not None
+
+
+def record(event, **fields):
+    # emit a single JSON line
+    if _sink is None:
+        return
+    _sink.write(json.dumps({'event': event, 'time': time.time(), **fields}) + '\n')
+    _sink.flush()
+
+
+def count(name, n=1):
+    # add to a counter of every open phase
+    for counters in _phases:
+        counters[name] = counters.get(name, 0) + n
+
+
+def peak_rss_mb():
+    # peak resident set size of this process (ru_maxrss is in kilobytes on Linux, bytes on macOS)
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1 << 20) if sys.platform == 'darwin' else peak_rss / (1 << 10)
+
+
+@contextmanager
+def phase(name, **tags):
+    # time a phase of a run, recording its counters and their rates when it ends
+    counters = {}
+    _phases.append(counters)
+    start = time.perf_counter()
+    try:
+        yield counters
+    finally:
+        seconds = time.perf_counter() - start
+        _phases.pop()
+        rates = {f'{k}_per_second': v / seconds for k, v in counters.items() if seconds > 0}
+        record('phase', name=name, seconds=seconds, peak_rss_mb=peak_rss_mb(), **tags, **counters, **rates)
+
+
+@contextmanager
+def profile(path, limit=25):
+    # run the block under cProfile, dumping the stats to the given file and printing the most expensive calls
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(limit)
@@ -0,0 +1,166 @@
+# movetable.py
+# ----------
+# Move engine for packed boards (see bitboard.py) built on precomputed row transition tables.
+# Every row of a board is itself a packed int (4 bits per cell), so a move is one table lookup per row or column.
+
+from itertools import product
+import bitboard
+
+# cache of move tables, one per (board_size, win_score)
+_move_tables = {}
+
+
+class RowTable(dict):
+    # maps a packed row to a precomputed result, computing rows missing from the table on first use
+    def __init__(self, compute):
+        dict.__init__(self)
+        self.compute = compute
+
+    def __missing__(self, row):
+        result = self.compute(row)
+        self[row] = result
+        return result
+
+
+class MoveTable:
+    def __init__(self, board_size, win_score):
+        self.board_size = board_size
+        self.win_score = win_score
+        self.row_bits = bitboard.CELL_BITS * board_size
+        self.row_mask = (1 << self.row_bits) - 1
+        self.win_exponent = bitboard.tile_exponent(win_score)
+
+        # row -> (moved row, score increment, changed flag, move exists flag)
+        self.left_rows = RowTable(self.compute_left)
+        self.right_rows = RowTable(self.compute_right)
+        # row -> the same cells laid out as a column starting at the top-left cell
+        self.column_rows = RowTable(self.compute_column)
+        # column (as a row) -> (moved column spread into column positions, score increment), so vertical moves
+        # write their result straight into the board instead of transposing it back
+        self.up_rows = RowTable(lambda row: self.compute_vertical(self.left_rows[row]))
+        self.down_rows = RowTable(lambda row: self.compute_vertical(self.right_rows[row]))
+        # row -> whether the row holds the winning tile
+        self.win_rows = RowTable(self.compute_win)
+
+        # lowest bit of every cell, of the cells above another cell and of the cells left of another cell
+        self.cell_bits = sum(1 << (bitboard.CELL_BITS * k) for k in range(board_size * board_size))
+        self.vertical_bits = self.cell_bits >> self.row_bits
+        self.horizontal_bits = sum(1 << (self.row_bits * i + bitboard.CELL_BITS * j)
+                                   for i in range(board_size) for j in range(board_size - 1))
+
+        # precompute every row that can occur before the target score is reached
+        for cells in product(range(self.win_exponent + 1), repeat=board_size):
+            row = bitboard.from_cells(cells)
+            self.left_rows[row] = self.compute_left(row)
+            self.right_rows[row] = self.compute_right(row)
+            self.column_rows[row] = self.compute_column(row)
+            self.up_rows[row] = self.compute_vertical(self.left_rows[row])
+            self.down_rows[row] = self.compute_vertical(self.right_rows[row])
+            self.win_rows[row] = self.compute_win(row)
+
+    def compute_left(self, row):
+        cells = self.get_row_cells(row)
+        moved_cells, score_increment = bitboard.move_row_left(cells)
+        moved_row = bitboard.from_cells(moved_cells)
+        return moved_row, score_increment, moved_row != row, self.row_move_exists(cells)
+
+    def compute_right(self, row):
+        cells = self.get_row_cells(row)
+        moved_cells, score_increment = bitboard.move_row_left(cells[::-1])
+        moved_row = bitboard.from_cells(moved_cells[::-1])
+        return moved_row, score_increment, moved_row != row, self.row_move_exists(cells)
+
+    def compute_column(self, row):
+        column = 0
+        for j, e in enumerate(self.get_row_cells(row)):
+            column |= e << (self.row_bits * j)
+        return column
+
+    def compute_vertical(self, moved):
+        moved_row, score_increment, _, _ = moved
+        return self.column_rows[moved_row], score_increment
+
+    def compute_win(self, row):
+        return self.win_exponent in self.get_row_cells(row)
+
+    def get_row_cells(self, row):
+        return [(row >> (bitboard.CELL_BITS * j)) & bitboard.CELL_MASK for j in range(self.board_size)]
+
+    @staticmethod
+    def row_move_exists(cells):
+        # a row can move if it has an empty cell or two adjacent equal tiles
+        return 0 in cells or any(cells[j] == cells[j+1] for j in range(len(cells) - 1))
+
+    def get_rows(self, board):
+        return [(board >> (self.row_bits * i)) & self.row_mask for i in range(self.board_size)]
+
+    def transpose(self, board):
+        transposed = 0
+        for i, row in enumerate(self.get_rows(board)):
+            transposed |= self.column_rows[row] << (bitboard.CELL_BITS * i)
+        return transposed
+
+    def apply(self, board, rows):
+        moved = 0
+        score_increment = 0
+        for i, row in enumerate(self.get_rows(board)):
+            moved_row, row_score, _, _ = rows[row]
+            moved |= moved_row << (self.row_bits * i)
+            score_increment += row_score
+        return moved, score_increment
+
+    def left(self, board):
+        return self.apply(board, self.left_rows)
+
+    def right(self, board):
+        return self.apply(board, self.right_rows)
+
+    def apply_vertical(self, board, columns):
+        # move every column, read as a row of the transposed board, and write it back as a column
+        transposed = self.transpose(board)
+        moved = 0
+        score_increment = 0
+        for j in range(self.board_size):
+            moved_column, column_score = columns[(transposed >> (self.row_bits * j)) & self.row_mask]
+            moved |= moved_column << (bitboard.CELL_BITS * j)
+            score_increment += column_score
+        return moved, score_increment
+
+    def up(self, board):
+        return self.apply_vertical(board, self.up_rows)
+
+    def down(self, board):
+        return self.apply_vertical(board, self.down_rows)
+
+    @staticmethod
+    def has_zero_cell(board, cells):
+        # whether one of the given cells (by their lowest bit) is zero, folding every cell's bits into its lowest bit
+        board |= board >> 2
+        board |= board >> 1
+        return board & cells != cells
+
+    def horizontal_move_exists(self, board):
+        # a row can move if the board has an empty cell or two horizontally adjacent equal tiles, found as zero cells
+        # of the board xor itself shifted by a cell
+        return self.has_zero_cell(board, self.cell_bits) or \
+            self.has_zero_cell(board ^ (board >> bitboard.CELL_BITS), self.horizontal_bits)
+
+    def vertical_move_exists(self, board):
+        return self.has_zero_cell(board, self.cell_bits) or \
+            self.has_zero_cell(board ^ (board >> self.row_bits), self.vertical_bits)
+
+    def is_win_state(self, board):
+        return any(self.win_rows[row] for row in self.get_rows(board))
+
+    def is_lose_state(self, board):
+        return not (self.has_zero_cell(board, self.cell_bits) or
+                    self.has_zero_cell(board ^ (board >> bitboard.CELL_BITS), self.horizontal_bits) or
+                    self.has_zero_cell(board ^ (board >> self.row_bits), self.vertical_bits))
+
+
+# get the (shared) move table for the given board size and target score
+def get_move_table(board_size, win_score):
+    key = (board_size, win_score)
+    if key not in _move_tables:
+        _move_tables[key] = MoveTable(board_size, win_score)
+    return _move_tables[key]
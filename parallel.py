@@ -0,0 +1,169 @@
+# parallel.py
+# ----------
+# Synchronous value iteration across a persistent pool of worker processes
+# The transition model (see bellman.py) and a double-buffered value table live in shared memory,
+# and each worker backs up a fixed contiguous shard of states on every iteration.
+# Iterations are driven over a pipe per worker, so a worker that dies is noticed instead of waited on forever.
+
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+from scipy.sparse import csr_matrix
+from bellman import ACTIONS
+import multiprocessing
+import numpy as np
+
+# seconds to wait for the workers to finish an iteration before giving up
+STEP_TIMEOUT = 600
+
+
+# copy an array into a new shared memory block, returning a view of the block and its descriptor
+def share_array(array, blocks):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(shm)
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    return view, (shm.name, array.shape, array.dtype.str)
+
+
+# attach to an array shared by share_array
+def attach_array(descriptor, blocks):
+    name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    blocks.append(shm)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def backup_worker(descriptors, num_states, lo, hi, gamma, conn):
+    blocks = []
+    arrays = {key: attach_array(descriptor, blocks) for key, descriptor in descriptors.items()}
+
+    # rows of every transition matrix belonging to this shard, viewed in place
+    shard = []
+    for a in ACTIONS:
+        indptr = arrays[f'{a}_indptr']
+        begin, end = indptr[lo], indptr[hi]
+        transitions = csr_matrix(
+            (arrays[f'{a}_data'][begin:end], arrays[f'{a}_indices'][begin:end], indptr[lo:hi+1] - begin),
+            shape=(hi - lo, num_states)
+        )
+        shard.append((transitions, arrays[f'{a}_rewards'][lo:hi], arrays[f'{a}_legal'][lo:hi]))
+    terminal = arrays['terminal'][lo:hi]
+    values = arrays['values']
+
+    iteration = 0
+    while True:
+        # None asks the worker to stop, as does the parent going away
+        try:
+            command = conn.recv()
+        except EOFError:
+            break
+        if command is None:
+            break
+
+        # read the previous iteration's buffer, write this iteration's
+        old_values = values[iteration % 2]
+        q_max = np.full(hi - lo, -np.inf)
+        for transitions, rewards, legal in shard:
+            q_a = rewards + gamma * (transitions @ old_values)
+            q_max = np.where(legal, np.maximum(q_max, q_a), q_max)
+        values[(iteration + 1) % 2][lo:hi] = np.where(terminal, old_values[lo:hi], q_max)
+        iteration += 1
+        conn.send(iteration)
+
+    del shard, terminal, values, arrays
+    for shm in blocks:
+        shm.close()
+
+
+class ParallelBackup:
+    def __init__(self, model, gamma, processes, values, timeout=STEP_TIMEOUT):
+        if processes < 1:
+            raise ValueError(f'Invalid number of processes: {processes}')
+        self.timeout = timeout
+        self.blocks = []
+        self.iteration = 0
+        num_states = len(model.states)
+
+        # share the transition model and both value buffers with the workers
+        descriptors = {}
+        for a in ACTIONS:
+            transitions = model.transitions[a]
+            _, descriptors[f'{a}_indptr'] = share_array(transitions.indptr, self.blocks)
+            _, descriptors[f'{a}_indices'] = share_array(transitions.indices, self.blocks)
+            _, descriptors[f'{a}_data'] = share_array(transitions.data, self.blocks)
+            _, descriptors[f'{a}_rewards'] = share_array(model.rewards[a], self.blocks)
+            _, descriptors[f'{a}_legal'] = share_array(model.legal[a], self.blocks)
+        _, descriptors['terminal'] = share_array(model.terminal, self.blocks)
+        self.values, descriptors['values'] = share_array(np.stack([values, values]).astype(float), self.blocks)
+
+        # split states into contiguous shards holding roughly equal numbers of transitions
+        total_indptr = sum(model.transitions[a].indptr.astype(np.int64) for a in ACTIONS)
+        bounds = np.searchsorted(total_indptr, np.linspace(0, total_indptr[-1], processes + 1))
+        bounds[0], bounds[-1] = 0, num_states
+
+        # start workers once, they wait on their pipe between iterations
+        self.workers = []
+        self.conns = []
+        for k in range(processes):
+            conn, worker_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=backup_worker,
+                args=(descriptors, num_states, bounds[k], bounds[k+1], gamma, worker_conn),
+                daemon=True
+            )
+            worker.start()
+            worker_conn.close()
+            self.workers.append(worker)
+            self.conns.append(conn)
+
+    def step(self):
+        # run one synchronous backup across all shards, returning a copy of the new values
+        # (the shared blocks are unlinked on close, so views into them must not escape)
+        for k, conn in enumerate(self.conns):
+            try:
+                conn.send(self.iteration)
+            except (BrokenPipeError, ConnectionResetError):
+                raise RuntimeError(f'Value iteration workers {[k]} exited') from None
+        # wait for every worker to report back, failing as soon as one of them exits
+        pending = {conn: k for k, conn in enumerate(self.conns)}
+        while pending:
+            ready = wait(list(pending) + [self.workers[k].sentinel for k in pending.values()], self.timeout)
+            if len(ready) == 0:
+                raise RuntimeError(f'Value iteration workers {sorted(pending.values())} did not finish within '
+                                   f'{self.timeout} seconds')
+            for conn in [r for r in ready if r in pending]:
+                try:
+                    conn.recv()
+                except (EOFError, ConnectionResetError):
+                    raise RuntimeError(f'Value iteration workers {[pending[conn]]} exited') from None
+                del pending[conn]
+            dead = [k for k in pending.values() if not self.workers[k].is_alive()]
+            if dead:
+                raise RuntimeError(f'Value iteration workers {dead} exited')
+        self.iteration += 1
+        return self.values[self.iteration % 2].copy()
+
+    def close(self):
+        # ask live workers to stop, terminating any that do not
+        for conn, worker in zip(self.conns, self.workers):
+            if worker.is_alive():
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+        for conn, worker in zip(self.conns, self.workers):
+            worker.join(self.timeout)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+            conn.close()
+        del self.values
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,81 @@
+# runner.py
+# ----------
+# Event-driven 2048 game without any GUI, applying each action straight to the board
+# Actions come from an agent or from a recorded game, the GUI (see game.py) drives the same runner one move per event
+
+import json
+import random
+from matrix import *
+
+MOVES = {'up': up, 'down': down, 'left': left, 'right': right}
+
+
+class GameRunner:
+    def __init__(self, board_size=2, win_score=32, seed=2000, agent=None, actions=None):
+        # actions are chosen by the agent, or replayed from a recorded list
+        if (agent is None) == (actions is None):
+            raise ValueError('Either an agent or a list of actions to replay is required')
+        self.agent = agent
+        self.replay_actions = actions
+        self.board_size = board_size
+        self.win_score = win_score
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.matrix = generate_start_state(board_size, self.rng)
+        self.score = 0
+        self.actions = []
+
+    def get_action(self):
+        if self.replay_actions is None:
+            return self.agent.get_policy(self.agent.mdp.to_state(self.matrix))
+        if len(self.actions) == len(self.replay_actions):
+            raise ValueError(f'Recorded game ended after {len(self.actions)} actions')
+        return self.replay_actions[len(self.actions)]
+
+    def step(self):
+        # apply the next action and add a new tile, returning the action
+        action = self.get_action()
+        if action not in MOVES:
+            raise ValueError(f'Invalid policy {action}')
+        move_exists = horizontal_move_exists if action in ('left', 'right') else vertical_move_exists
+        if not move_exists(self.matrix):
+            raise ValueError(f'Illegal action {action} after {len(self.actions)} actions')
+
+        self.matrix, score_increment = MOVES[action](self.matrix)
+        self.score += score_increment
+        self.matrix = add_new_tile(self.matrix, self.rng)
+        self.actions.append(action)
+        return action
+
+    def is_win(self):
+        return is_win_state(self.matrix, self.win_score)
+
+    def is_over(self):
+        return self.is_win() or is_lose_state(self.matrix)
+
+    def run(self):
+        # play until the game is over, as fast as actions can be chosen
+        while not self.is_over():
+            self.step()
+        return self
+
+    def get_record(self):
+        # everything needed to replay the game: the seed fixes the start state and every new tile
+        return {'board_size': self.board_size, 'win_score': self.win_score, 'seed': self.seed, 'score': self.score,
+                'actions': self.actions}
+
+
+def save_records(path, records):
+    # one recorded game per line
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def load_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay_runner(record):
+    return GameRunner(record['board_size'], record['win_score'], record['seed'], actions=record['actions'])
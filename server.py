@@ -0,0 +1,262 @@
+# server.py
+# ----------
+# Local policy server: loads a trained agent once and answers batched best action / q-value requests over a Unix
+# socket or localhost TCP, with a compact binary framing, request pipelining and latency/throughput counters
+#
+# Every frame is a header followed by a payload of the given number of bytes:
+#   request:  request id (uint32), kind (uint8), payload length (uint32), packed boards (uint64 each, see bitboard.py)
+#   response: request id (uint32), status (uint8), payload length (uint32), then
+#             actions: one uint8 per board, an index into ACTIONS or NO_ACTION for terminal boards
+#             q-values: actions, followed by float32 q-values of shape (boards, 4), NaN for illegal actions
+#             stats: JSON counters; errors: UTF-8 message
+# Requests may be pipelined, responses are sent in request order.
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import time
+from collections import deque
+import numpy as np
+import bitboard
+import metrics
+from bellman import ACTIONS
+from cli import add_common_arguments, run_with_metrics, make_board, make_agent
+
+HEADER = struct.Struct('<IBI')
+
+# request kinds
+GET_ACTIONS = 0
+GET_Q_VALUES = 1
+GET_STATS = 2
+
+# response statuses
+OK = 0
+ERROR = 1
+
+# action of terminal boards
+NO_ACTION = 255
+
+
+class PolicyServer:
+    def __init__(self, agent, max_latencies=100000):
+        # boards are sent packed into 64 bits
+        if agent.mdp.board_size * agent.mdp.board_size * bitboard.CELL_BITS > 64:
+            raise ValueError(f'Board too large to serve: {agent.mdp.board_size}')
+        self.agent = agent
+        self.mdp = agent.mdp
+        self.start_time = time.time()
+        self.connections = 0
+        self.requests = 0
+        self.boards = 0
+        self.errors = 0
+        self.busy_seconds = 0
+        # latencies of the most recent requests, in seconds
+        self.latencies = deque(maxlen=max_latencies)
+
+    def get_terminal(self, boards):
+        # terminal mask of the boards, read from the store's masks for stored boards
+        terminal = np.zeros(len(boards), dtype=bool)
+        stored = np.zeros(len(boards), dtype=bool)
+        store = self.mdp.store
+        if store.states is not None and len(store.states) > 0:
+            indices = store.indices_of(self.mdp.canonicalize_packed(boards)[0])
+            stored = indices >= 0
+            terminal[stored] = np.asarray(store.win)[indices[stored]] | np.asarray(store.lose)[indices[stored]]
+        # boards outside the state set
+        for i in np.flatnonzero(~stored):
+            terminal[i] = self.mdp.is_terminal(self.mdp.from_packed(int(boards[i])))
+        return terminal
+
+    def get_actions(self, boards):
+        # best action of every board, NO_ACTION for terminal boards
+        live = ~self.get_terminal(boards)
+        actions = np.full(len(boards), NO_ACTION, dtype=np.uint8)
+        if live.any():
+            actions[live] = self.agent.get_policies(boards[live])
+        return actions
+
+    def get_q_values(self, boards):
+        if not hasattr(self.agent, 'get_q_value'):
+            raise ValueError(f'{type(self.agent).__name__} does not provide q-values')
+        q_values = np.full((len(boards), len(ACTIONS)), np.nan, dtype=np.float32)
+        for i, b in enumerate(boards):
+            s = self.mdp.from_packed(int(b))
+            for a in self.mdp.get_legal_actions(s):
+                q_values[i, ACTIONS.index(a)] = self.agent.get_q_value(s, a)
+        return q_values
+
+    def get_stats(self):
+        uptime = time.time() - self.start_time
+        latencies = np.array(self.latencies)
+        stats = {'connections': self.connections, 'requests': self.requests, 'boards': self.boards,
+                 'errors': self.errors, 'uptime_seconds': uptime, 'busy_seconds': self.busy_seconds,
+                 'requests_per_second': self.requests / uptime, 'boards_per_second': self.boards / uptime}
+        if len(latencies) > 0:
+            p50, p99 = np.percentile(latencies, [50, 99])
+            stats.update(latency_p50_ms=float(p50) * 1e3, latency_p99_ms=float(p99) * 1e3,
+                         latency_max_ms=float(latencies.max()) * 1e3)
+        return stats
+
+    def respond(self, request_id, kind, payload):
+        # answer a single request, errors are reported to the client instead of closing the connection
+        start = time.perf_counter()
+        try:
+            if kind == GET_STATS:
+                response = json.dumps(self.get_stats()).encode()
+            elif kind in (GET_ACTIONS, GET_Q_VALUES):
+                boards = np.frombuffer(payload, dtype='<u8')
+                response = self.get_actions(boards).tobytes()
+                if kind == GET_Q_VALUES:
+                    response += self.get_q_values(boards).astype('<f4').tobytes()
+                self.boards += len(boards)
+            else:
+                raise ValueError(f'Invalid request kind: {kind}')
+            status = OK
+        except Exception as e:
+            response = str(e).encode()
+            status = ERROR
+            self.errors += 1
+
+        seconds = time.perf_counter() - start
+        self.requests += 1
+        self.busy_seconds += seconds
+        self.latencies.append(seconds)
+        return HEADER.pack(request_id, status, len(response)) + response
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_id, kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+                payload = await reader.readexactly(length)
+                writer.write(self.respond(request_id, kind, payload))
+                # only waits once the client stops reading, so pipelined requests keep flowing
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path=None, port=None):
+        # listen on localhost TCP when a port is given, on a Unix socket otherwise
+        if port is not None:
+            server = await asyncio.start_server(self.handle, '127.0.0.1', port)
+            print(f'Serving {type(self.agent).__name__} on 127.0.0.1:{port}')
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            # replace a socket left behind by a previous server, never any other file
+            if os.path.exists(path):
+                if not stat.S_ISSOCK(os.stat(path).st_mode):
+                    raise ValueError(f'Not a socket: {path}')
+                os.remove(path)
+            server = await asyncio.start_unix_server(self.handle, path)
+            print(f'Serving {type(self.agent).__name__} on {path}')
+        # serve until interrupted or terminated
+        stopped = asyncio.get_running_loop().create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(sig, lambda: stopped.done() or stopped.set_result(None))
+            except NotImplementedError:
+                # no signal handlers on Windows event loops, Ctrl+C still interrupts
+                pass
+        try:
+            async with server:
+                await stopped
+        finally:
+            if port is None and os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                os.remove(path)
+
+
+class PolicyClient:
+    def __init__(self, path=None, port=None):
+        # blocking client, requests can be pipelined with send and receive
+        if port is not None:
+            self.socket = socket.create_connection(('127.0.0.1', port))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(path)
+        self.file = self.socket.makefile('rb')
+        self.next_id = 0
+        self.pending = {}
+
+    def send(self, kind, boards=()):
+        # send a request without waiting for its response, returning its id
+        boards = np.asarray(boards, dtype='<u8')
+        request_id = self.next_id
+        self.next_id += 1
+        self.pending[request_id] = (kind, len(boards))
+        self.socket.sendall(HEADER.pack(request_id, kind, boards.nbytes) + boards.tobytes())
+        return request_id
+
+    def receive(self):
+        # next response as (request id, result), result being actions, (actions, q-values) or stats
+        header = self.file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ConnectionError('Policy server closed the connection')
+        request_id, status, length = HEADER.unpack(header)
+        payload = self.file.read(length)
+        if len(payload) < length:
+            raise ConnectionError('Policy server closed the connection')
+        kind, count = self.pending.pop(request_id)
+        if status == ERROR:
+            raise ValueError(payload.decode())
+        if kind == GET_STATS:
+            return request_id, json.loads(payload)
+        actions = np.frombuffer(payload[:count], dtype=np.uint8)
+        if kind == GET_Q_VALUES:
+            return request_id, (actions, np.frombuffer(payload[count:], dtype='<f4').reshape(count, len(ACTIONS)))
+        return request_id, actions
+
+    def request(self, kind, boards=()):
+        self.send(kind, boards)
+        return self.receive()[1]
+
+    def get_actions(self, boards):
+        return self.request(GET_ACTIONS, boards)
+
+    def get_q_values(self, boards):
+        return self.request(GET_Q_VALUES, boards)
+
+    def get_stats(self):
+        return self.request(GET_STATS)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_arguments(parser)
+    parser.add_argument('-u', dest='socket_path', help='Unix socket to listen on (default ./out/policy_server.sock).', default='./out/policy_server.sock')
+    parser.add_argument('-p', dest='port', help='Localhost TCP port to listen on instead of the Unix socket.', default=None)
+    args = parser.parse_args()
+    run_with_metrics(run, args)
+
+
+def run(args):
+    port = int(args.port) if args.port is not None else None
+
+    # initialize value iteration agent
+    agent = make_agent(args, make_board(args))
+
+    # serve until stopped, recording the counters on the way out
+    server = PolicyServer(agent)
+    try:
+        asyncio.run(server.serve(args.socket_path, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stats = server.get_stats()
+        metrics.record('policy_server', **stats)
+        print(f'Policy server stats: {stats}')
+
+
+if __name__ == '__main__':
+    main()
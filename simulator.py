@@ -0,0 +1,130 @@
+# simulator.py
+# ----------
+# Batched, vectorized 2048 simulator playing thousands of games at once
+# Boards are held as an array of cell exponents (see bitboard.py) of shape (games, board_size, board_size),
+# every move is a lookup of all rows in a precomputed table, and finished games are retired with masks.
+
+import numpy as np
+import bitboard
+
+# cache of row tables, one per board size
+_row_tables = {}
+
+
+# left move of every possible row (4 bits per cell): moved row cells and score increment
+def get_row_table(board_size):
+    if board_size not in _row_tables:
+        num_rows = 1 << (bitboard.CELL_BITS * board_size)
+        moved_rows = np.zeros((num_rows, board_size), dtype=np.uint8)
+        row_scores = np.zeros(num_rows, dtype=np.int64)
+        for row in range(num_rows):
+            cells = [(row >> (bitboard.CELL_BITS * j)) & bitboard.CELL_MASK for j in range(board_size)]
+            moved_row, row_scores[row] = bitboard.move_row_left(cells)
+            moved_rows[row] = np.minimum(moved_row, bitboard.MAX_EXPONENT)
+        _row_tables[board_size] = moved_rows, row_scores
+    return _row_tables[board_size]
+
+
+# rotate/reflect boards so the given action (index into bellman.ACTIONS) becomes a left move
+def orient(cells, action):
+    if action in (0, 1):
+        cells = cells.transpose(0, 2, 1)
+    if action in (1, 3):
+        cells = cells[:, :, ::-1]
+    return cells
+
+
+# undo orient
+def unorient(cells, action):
+    if action in (1, 3):
+        cells = cells[:, :, ::-1]
+    if action in (0, 1):
+        cells = cells.transpose(0, 2, 1)
+    return cells
+
+
+class BatchSimulator:
+    def __init__(self, board_size, win_score, rng=None):
+        # packed boards are 64 bit integers
+        if board_size * board_size * bitboard.CELL_BITS > 64:
+            raise ValueError(f'Board too large for batch simulation: {board_size}')
+        self.board_size = board_size
+        self.win_exponent = bitboard.tile_exponent(win_score)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.moved_rows, self.row_scores = get_row_table(board_size)
+        self.row_weights = 1 << (bitboard.CELL_BITS * np.arange(board_size, dtype=np.int64))
+        self.cell_shifts = np.uint64(bitboard.CELL_BITS) * np.arange(board_size * board_size, dtype=np.uint64)
+
+    def pack(self, cells):
+        # packed board (see bitboard.py) of every game
+        flat_cells = cells.reshape(len(cells), -1).astype(np.uint64)
+        return np.bitwise_or.reduce(flat_cells << self.cell_shifts, axis=1)
+
+    def generate_start_states(self, num_games):
+        # two 2 tiles in distinct random cells
+        num_cells = self.board_size * self.board_size
+        cells = np.zeros((num_games, num_cells), dtype=np.uint8)
+        first = self.rng.integers(num_cells, size=num_games)
+        second = self.rng.integers(num_cells - 1, size=num_games)
+        second += second >= first
+        cells[np.arange(num_games), first] = 1
+        cells[np.arange(num_games), second] = 1
+        return cells.reshape(num_games, self.board_size, self.board_size)
+
+    def move_left(self, cells):
+        rows = (cells.astype(np.int64) * self.row_weights).sum(axis=2)
+        return self.moved_rows[rows], self.row_scores[rows].sum(axis=1)
+
+    def move(self, cells, actions):
+        # apply each game's action, returning the moved boards and score increments
+        moved = np.empty_like(cells)
+        score_increments = np.zeros(len(cells), dtype=np.int64)
+        for a in range(4):
+            mask = actions == a
+            if mask.any():
+                moved_a, score_increments[mask] = self.move_left(orient(cells[mask], a))
+                moved[mask] = unorient(moved_a, a)
+        return moved, score_increments
+
+    def add_new_tiles(self, cells):
+        # fill a uniformly chosen empty cell of every game with a 2 (p=0.9) or 4 (p=0.1)
+        flat_cells = cells.reshape(len(cells), -1)
+        empty = flat_cells == 0
+        num_empty = empty.sum(axis=1)
+        k = (self.rng.random(len(cells)) * num_empty).astype(np.int64)
+        positions = (np.cumsum(empty, axis=1) > k[:, None]).argmax(axis=1)
+        tiles = np.where(self.rng.random(len(cells)) < 0.9, 1, 2).astype(np.uint8)
+        games = np.flatnonzero(num_empty > 0)
+        flat_cells[games, positions[games]] = tiles[games]
+        return flat_cells.reshape(cells.shape)
+
+    def is_win_state(self, cells):
+        return (cells == self.win_exponent).any(axis=(1, 2))
+
+    def is_lose_state(self, cells):
+        empty = (cells == 0).any(axis=(1, 2))
+        horizontal = (cells[:, :, 1:] == cells[:, :, :-1]).any(axis=(1, 2))
+        vertical = (cells[:, 1:, :] == cells[:, :-1, :]).any(axis=(1, 2))
+        return ~(empty | horizontal | vertical)
+
+    def play(self, num_games, get_policies):
+        # play games to the end, get_policies maps an array of packed boards to indices into bellman.ACTIONS
+        cells = self.generate_start_states(num_games)
+        wins = np.zeros(num_games, dtype=bool)
+        scores = np.zeros(num_games, dtype=np.int64)
+        live = np.arange(num_games)
+        while len(live) > 0:
+            # retire finished games
+            live_cells = cells[live]
+            won = self.is_win_state(live_cells)
+            done = won | self.is_lose_state(live_cells)
+            wins[live[won]] = True
+            live, live_cells = live[~done], live_cells[~done]
+            if len(live) == 0:
+                break
+
+            # move every live game and spawn its new tile
+            moved, score_increments = self.move(live_cells, np.asarray(get_policies(self.pack(live_cells))))
+            cells[live] = self.add_new_tiles(moved)
+            scores[live] += score_increments
+        return wins, scores
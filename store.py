@@ -0,0 +1,79 @@
+# store.py
+# ----------
+# Binary on-disk store of an MDP's states, terminal masks and legal actions, loaded through numpy.memmap
+# States are stored packed (see bitboard.py) as uint64, in enumeration order, so any array
+# indexed by state (terminal masks, values, policies) lines up with them.
+
+import numpy as np
+import os
+
+
+class StateStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.states_path = os.path.join(directory, 'states.npy')
+        self.order_path = os.path.join(directory, 'order.npy')
+        self.win_path = os.path.join(directory, 'win.npy')
+        self.lose_path = os.path.join(directory, 'lose.npy')
+        self.actions_path = os.path.join(directory, 'actions.npy')
+        self.pred_offsets_path = os.path.join(directory, 'pred_offsets.npy')
+        self.pred_indices_path = os.path.join(directory, 'pred_indices.npy')
+        self.states = None
+        self.order = None
+        self.win = None
+        self.lose = None
+        self.actions = None
+
+    def exists(self):
+        return all(os.path.isfile(p) for p in
+                   [self.states_path, self.order_path, self.win_path, self.lose_path, self.actions_path])
+
+    def write(self, packed_states, win_mask, lose_mask, action_masks):
+        # action_masks holds one bit per legal action of each state
+        os.makedirs(self.directory, exist_ok=True)
+        states = np.array(packed_states, dtype=np.uint64)
+        # a predecessor index of previously stored states no longer lines up
+        if os.path.isfile(self.pred_offsets_path):
+            os.remove(self.pred_offsets_path)
+        # states file is written last, so a partially written store is never considered complete
+        np.save(self.order_path, np.argsort(states, kind='stable'))
+        np.save(self.win_path, np.array(win_mask, dtype=bool))
+        np.save(self.lose_path, np.array(lose_mask, dtype=bool))
+        np.save(self.actions_path, np.array(action_masks, dtype=np.uint8))
+        np.save(self.states_path, states)
+        self.load()
+
+    def load(self):
+        # memory-map every array, nothing is parsed until it is accessed
+        self.states = np.load(self.states_path, mmap_mode='r')
+        self.order = np.load(self.order_path, mmap_mode='r')
+        self.win = np.load(self.win_path, mmap_mode='r')
+        self.lose = np.load(self.lose_path, mmap_mode='r')
+        self.actions = np.load(self.actions_path, mmap_mode='r')
+
+    def predecessors_exist(self):
+        return os.path.isfile(self.pred_offsets_path) and os.path.isfile(self.pred_indices_path)
+
+    def write_predecessors(self, offsets, indices):
+        # offsets file is written last, so a partially written index is never considered complete
+        np.save(self.pred_indices_path, indices)
+        np.save(self.pred_offsets_path, offsets)
+
+    def load_predecessors(self):
+        # predecessor index as CSR arrays over state positions (see bellman.build_predecessors)
+        return np.load(self.pred_offsets_path, mmap_mode='r'), np.load(self.pred_indices_path, mmap_mode='r')
+
+    def index_of(self, packed_state):
+        # binary search for the state's position, -1 if it is not stored
+        key = np.uint64(packed_state)
+        pos = np.searchsorted(self.states, key, sorter=self.order)
+        if pos < len(self.states) and self.states[self.order[pos]] == key:
+            return int(self.order[pos])
+        return -1
+
+    def indices_of(self, packed_states):
+        # vectorized index_of over an array of packed states
+        keys = np.asarray(packed_states, dtype=np.uint64)
+        pos = np.minimum(np.searchsorted(self.states, keys, sorter=self.order), len(self.states) - 1)
+        indices = np.asarray(self.order[pos])
+        return np.where(self.states[indices] == keys, indices, -1)
@@ -3,36 +3,35 @@
 # Tests the selected value iteration agent on `neval` game instantiations
 
 import argparse
-from agents import ValueIterationAgent, AsynchronousValueIterationAgent, PrioritizedSweepingValueIterationAgent
-from gameboard import GameBoard
+from cli import add_common_arguments, run_with_metrics, make_board, make_agent
+import numpy as np
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-a', dest='agent', help='Agent to use for action selection (sync, async, sweeping).', default='sync')
-    parser.add_argument('-s', dest='board_size', help='Board dimension (default 2).', default=2)
-    parser.add_argument('-w', dest='win_score', help='Winning score (default 32).', default=32)
+    add_common_arguments(parser)
     parser.add_argument('-n', dest='neval', help='Number of evaluations to perform.', default=1000)
+    parser.add_argument('-p', dest='processes', help='Number of processes to run evaluations on (default 1).', default=1)
+    parser.add_argument('-d', dest='seed', help='Master seed for evaluation games (default random).', default=None)
     args = parser.parse_args()
+    run_with_metrics(run, args)
 
+
+def run(args):
     agent_type = args.agent
-    board_size = int(args.board_size)
-    win_score = int(args.win_score)
     n_eval = int(args.neval)
+    processes = int(args.processes)
+    seed = int(args.seed) if args.seed is not None else None
 
     # initialize value iteration agent
-    mdp = GameBoard(board_size, win_score)
-    if agent_type == 'sync':
-        agent = ValueIterationAgent(mdp, use_cache=True)
-    elif agent_type == 'async':
-        agent = AsynchronousValueIterationAgent(mdp, use_cache=True)
-    elif agent_type == 'sweeping':
-        agent = PrioritizedSweepingValueIterationAgent(mdp, use_cache=True)
-    else:
-        raise ValueError(f'Invalid agent type: {agent_type}')
+    mdp = make_board(args)
+    agent = make_agent(args, mdp)
 
     # run evaluation on trained agent
-    print(f'{agent_type} agent win rate: {agent.evaluate(n_eval)}')
+    print(f'{agent_type} agent win rate: {agent.evaluate(n_eval, seed=seed, processes=processes)}')
+    percentiles = np.percentile(agent.eval_scores, [10, 50, 90])
+    print(f'{agent_type} agent score mean: {agent.eval_scores.mean()}, 10/50/90th percentiles: {percentiles}, '
+          f'max: {agent.eval_scores.max()}')
 
 
 if __name__ == '__main__':
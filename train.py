@@ -3,38 +3,41 @@
 # Trains the selected value iteration agent
 
 import argparse
-from agents import ValueIterationAgent, AsynchronousValueIterationAgent, PrioritizedSweepingValueIterationAgent
-from gameboard import GameBoard
+from cli import add_common_arguments, run_with_metrics, make_board, make_agent
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-a', dest='agent', help='Agent to use for action selection (sync, async, sweeping).', default='sync')
-    parser.add_argument('-s', dest='board_size', help='Board dimension (default 2).', default=2)
-    parser.add_argument('-w', dest='win_score', help='Winning score (default 32).', default=32)
+    add_common_arguments(parser, epsilon_help='Stop once the policy is epsilon-optimal (default: run all iterations).')
     parser.add_argument('-n', dest='neval', help='Number of evaluations to perform.', default=1000)
     parser.add_argument('-p', dest='processes', help='Number of processes to run for synchronous value iteration.', default=-1)
+    parser.add_argument('-d', dest='seed', help='Master seed for evaluation games (default random).', default=None)
+    parser.add_argument('-g', dest='episodes', help='Number of self-play games to train the n-tuple agent on (default 1000).', default=1000)
+    parser.add_argument('-k', dest='checkpoint_iterations', help='Checkpoint value iteration every k iterations.', default=None)
+    parser.add_argument('-l', dest='checkpoint_seconds', help='Checkpoint value iteration every l seconds.', default=None)
+    parser.add_argument('-u', dest='resume', help='Boolean flag to resume training from the latest checkpoint.', action='store_true')
+    parser.add_argument('-i', dest='warm_start', help='Config file of a solved configuration to warm start value iteration from (auto to pick the closest).', default=None)
     args = parser.parse_args()
+    run_with_metrics(run, args)
 
+
+def run(args):
     agent_type = args.agent
-    board_size = int(args.board_size)
-    win_score = int(args.win_score)
     n_eval = int(args.neval)
+    episodes = int(args.episodes)
     processes = int(args.processes)
+    seed = int(args.seed) if args.seed is not None else None
+    checkpoint_iterations = int(args.checkpoint_iterations) if args.checkpoint_iterations is not None else None
+    checkpoint_seconds = float(args.checkpoint_seconds) if args.checkpoint_seconds is not None else None
+    checkpoint = dict(checkpoint_iterations=checkpoint_iterations, checkpoint_seconds=checkpoint_seconds,
+                      resume=args.resume, warm_start=args.warm_start)
 
-    # initialize value iteration agent
-    mdp = GameBoard(board_size, win_score)
-    if agent_type == 'sync':
-        agent = ValueIterationAgent(mdp, use_cache=False, processes=processes)
-    elif agent_type == 'async':
-        agent = AsynchronousValueIterationAgent(mdp, use_cache=False)
-    elif agent_type == 'sweeping':
-        agent = PrioritizedSweepingValueIterationAgent(mdp, use_cache=False)
-    else:
-        raise ValueError(f'Invalid agent type: {agent_type}')
+    # initialize value iteration agent, training from scratch
+    mdp = make_board(args)
+    agent = make_agent(args, mdp, use_cache=False, processes=processes, episodes=episodes, **checkpoint)
 
     # run evaluation on trained agent
-    print(f'{agent_type} agent win rate: {agent.evaluate(n_eval)}')
+    print(f'{agent_type} agent win rate: {agent.evaluate(n_eval, seed=seed)}')
 
 
 if __name__ == '__main__':
@@ -12,6 +12,7 @@
 # Student side autograding was added by Brad Miller, Nick Hay, and
 # Pieter Abbeel (pabbeel@cs.berkeley.edu).
 
+from collections import OrderedDict
 import heapq
 
 
@@ -21,35 +22,86 @@ class PriorityQueue:
     has a priority associated with it and the client is usually interested
     in quick retrieval of the lowest-priority item in the queue. This
     data structure allows O(1) access to the lowest-priority item.
+
+    Each item's lowest-priority entry is indexed, so update is an
+    O(log n) decrease-key: the old entry is invalidated in place and
+    skipped when it reaches the top of the heap.
     """
 
     def __init__(self):
         self.heap = []
         self.count = 0
+        self.size = 0
+        self.entries = {}
 
     def push(self, item, priority):
-        entry = (priority, self.count, item)
+        entry = [priority, self.count, item, True]
         heapq.heappush(self.heap, entry)
         self.count += 1
+        self.size += 1
+        if item not in self.entries or priority < self.entries[item][0]:
+            self.entries[item] = entry
 
     def pop(self):
-        (_, _, item) = heapq.heappop(self.heap)
+        # discard invalidated entries
+        entry = heapq.heappop(self.heap)
+        while not entry[3]:
+            entry = heapq.heappop(self.heap)
+        (_, _, item, _) = entry
+        self.size -= 1
+        if self.entries.get(item) is entry:
+            del self.entries[item]
         return item
 
     def isEmpty(self):
-        return len(self.heap) == 0
+        return self.size == 0
+
+    def topPriority(self):
+        # priority of the item pop would return, discarding invalidated entries
+        while not self.heap[0][3]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0]
 
     def update(self, item, priority):
         # If item already in priority queue with higher priority, update its priority and rebuild the heap.
         # If item already in priority queue with equal or lower priority, do nothing.
         # If item not in priority queue, do the same thing as self.push.
-        for index, (p, c, i) in enumerate(self.heap):
-            if i == item:
-                if p <= priority:
-                    break
-                del self.heap[index]
-                self.heap.append((priority, c, item))
-                heapq.heapify(self.heap)
-                break
-        else:
+        entry = self.entries.get(item)
+        if entry is None:
             self.push(item, priority)
+        elif priority < entry[0]:
+            # invalidate the old entry, the new one keeps its insertion order
+            entry[3] = False
+            new_entry = [priority, entry[1], item, True]
+            heapq.heappush(self.heap, new_entry)
+            self.entries[item] = new_entry
+
+
+class LRUCache:
+    """
+    Implements a mapping holding at most max_size items. Looking up or
+    storing an item marks it as the most recently used one, and storing
+    an item in a full cache evicts the least recently used item.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            return default
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+    def __len__(self):
+        return len(self.items)